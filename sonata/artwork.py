@@ -1,3 +1,4 @@
+import collections
 import logging
 import os
 import shutil
@@ -6,12 +7,14 @@ import threading # artwork_update starts a thread _artwork_update
 from gi.repository import Gtk, Gdk, GdkPixbuf, GLib, GObject
 
 from sonata import img, ui, misc, consts, mpdhelper as mpdh
-from sonata import library
 from sonata.pluginsystem import pluginsystem
 
 
 logger = logging.getLogger(__name__)
 
+# Number of breadcrumb-sized covers kept around
+CRUMB_CACHE_SIZE = 64
+
 
 class Artwork(GObject.GObject):
 
@@ -69,7 +72,14 @@ class Artwork(GObject.GObject):
         self.lib_art_rows_local = []
         self.lib_art_rows_remote = []
         self.lib_art_pb_size = 0
+        # Rows of lib_model by lowercase (artist, album), see
+        # library_artwork_index()
+        self.lib_art_index = None
+        self.lib_art_index_handlers = []
         self.cache = {}
+        # breadcrumb-sized artwork: cache_key -> (filename, mtime, pixbuf),
+        # least recently used first
+        self.crumb_cache = collections.OrderedDict()
 
         self.artwork_load_cache()
 
@@ -120,25 +130,63 @@ class Artwork(GObject.GObject):
         thread.daemon = True
         thread.start()
 
+    def library_artwork_set_model(self, model):
+        self.library_artwork_index_reset()
+        self.lib_model = model
+
+    def library_artwork_index(self):
+        # Index the rows of the library by artist and album, so that the
+        # rows of the current song are found without going through the
+        # whole model each time. The index is built when first needed and
+        # dropped as soon as the model changes: nothing listens to the
+        # model while there's no index, like when it's being filled.
+        if self.lib_art_index is None:
+            index = {}
+            for row in self.lib_model:
+                data = row[1]
+                key = (str(data.artist).lower(), str(data.album).lower())
+                index.setdefault(key, []).append(row.iter)
+            self.lib_art_index = index
+            self.lib_art_index_handlers = [
+                self.lib_model.connect(signal, self.library_artwork_index_reset)
+                for signal in ('row-inserted', 'row-changed', 'row-deleted',
+                               'rows-reordered')]
+        return self.lib_art_index
+
+    def library_artwork_index_reset(self, *_args):
+        for handler in self.lib_art_index_handlers:
+            self.lib_model.disconnect(handler)
+        self.lib_art_index_handlers = []
+        self.lib_art_index = None
+
+    def library_artwork_set_pb(self, i, pb):
+        # Changing the icon of a row doesn't change the index
+        for handler in self.lib_art_index_handlers:
+            self.lib_model.handler_block(handler)
+        self.lib_model.set_value(i, 0, pb)
+        for handler in self.lib_art_index_handlers:
+            self.lib_model.handler_unblock(handler)
+
     def library_artwork_update(self, model, start_row, end_row, albumpb):
         self.albumpb = albumpb
 
         # Update self.lib_art_rows_local with new rows followed
         # by the rest of the rows.
-        self.lib_art_cond.acquire()
-        self.lib_art_rows_local = []
-        self.lib_art_rows_remote = []
-        start = start_row.get_indices()[0]
-        end = end_row.get_indices()[0]
-        test_rows = list(range(start, end + 1)) + list(range(len(model)))
-        for row in test_rows:
-            i = model.get_iter((row,))
-            icon = model.get_value(i, 0)
-            if icon == self.albumpb:
-                data = model.get_value(i, 1)
-                self.lib_art_rows_local.append((i, data, icon))
-        self.lib_art_cond.notifyAll()
-        self.lib_art_cond.release()
+        with self.lib_art_cond:
+            self.lib_art_rows_local = []
+            self.lib_art_rows_remote = []
+            start = start_row.get_indices()[0]
+            end = end_row.get_indices()[0]
+            test_rows = list(range(start, end + 1)) + list(range(len(model)))
+            for row in test_rows:
+                i = model.get_iter((row,))
+                icon = model.get_value(i, 0)
+                if icon == self.albumpb:
+                    data = model.get_value(i, 1)
+                    self.lib_art_rows_local.append((i, data, icon))
+            # Only wake up the artwork thread if there's work for it
+            if self.lib_art_rows_local:
+                self.lib_art_cond.notify()
 
     def _library_artwork_update(self):
 
@@ -146,11 +194,10 @@ class Artwork(GObject.GObject):
             remote_art = False
 
             # Wait for items..
-            self.lib_art_cond.acquire()
-            while(len(self.lib_art_rows_local) == 0 and \
-                  len(self.lib_art_rows_remote) == 0):
-                self.lib_art_cond.wait()
-            self.lib_art_cond.release()
+            with self.lib_art_cond:
+                self.lib_art_cond.wait_for(
+                    lambda: self.lib_art_rows_local or
+                            self.lib_art_rows_remote)
 
             # Try first element, giving precedence to local queue:
             if len(self.lib_art_rows_local) > 0:
@@ -171,9 +218,7 @@ class Artwork(GObject.GObject):
                     else:
                         self.lib_art_rows_local.pop(0)
 
-                cache_key = library.SongRecord(artist=data.artist,
-                                               album=data.album,
-                                               path=data.path)
+                cache_key = data.artwork_key()
 
                 # Try to replace default icons with cover art:
                 pb = self.get_library_artwork_cached_pb(cache_key, None)
@@ -205,12 +250,13 @@ class Artwork(GObject.GObject):
                                                             data.artist, data.album,
                                                         self.lib_art_pb_size)
 
-                # Set pixbuf icon in model; add to cache
+                # Set pixbuf icon in model; add to cache. Cached covers are
+                # loaded here too, instead of while the view is built.
                 if pb is not None:
                     if filename is not None:
                         self.set_library_artwork_cached_filename(cache_key,
                                                                  filename)
-                        GLib.idle_add(self.library_set_cover, i, pb, data)
+                    GLib.idle_add(self.library_set_cover, i, pb, data)
 
                 # Remote processed item from queue:
                 if not remote_art:
@@ -234,19 +280,22 @@ class Artwork(GObject.GObject):
     def library_set_image_for_current_song(self, cache_key):
         # Search through the rows in the library to see
         # if we match the currently playing song:
-        if cache_key.artist is None and cache_key.album is None:
+        artist, album, _path = cache_key
+        if artist is None and album is None:
             return
-        for row in self.lib_model:
-            if str(cache_key.artist).lower() == str(row[1].artist).lower() \
-            and str(cache_key.album).lower() == str(row[1].album).lower():
-                pb = self.get_library_artwork_cached_pb(cache_key, None)
-                if pb:
-                    self.lib_model.set_value(row.iter, 0, pb)
+        rows = self.library_artwork_index().get(
+            (str(artist).lower(), str(album).lower()))
+        if not rows:
+            return
+        pb = self.get_library_artwork_cached_pb(cache_key, None)
+        if pb:
+            for i in rows:
+                self.library_artwork_set_pb(i, pb)
 
     def library_set_cover(self, i, pb, data):
         if self.lib_model.iter_is_valid(i):
             if self.lib_model.get_value(i, 1) == data:
-                self.lib_model.set_value(i, 0, pb)
+                self.library_artwork_set_pb(i, pb)
 
     def library_get_album_cover(self, dirname, artist, album, pb_size):
         _tmp, coverfile = self.artwork_get_local_image(dirname, artist, album)
@@ -266,6 +315,7 @@ class Artwork(GObject.GObject):
 
     def set_library_artwork_cached_filename(self, cache_key, filename):
         self.cache[cache_key] = filename
+        self.crumb_cache.pop(cache_key, None)
 
     def get_library_artwork_cached_filename(self, cache_key):
         try:
@@ -285,10 +335,35 @@ class Artwork(GObject.GObject):
                                                          self.lib_art_pb_size)
             else:
                 self.cache.pop(cache_key)
+                self.crumb_cache.pop(cache_key, None)
                 return origpb
         else:
             return origpb
 
+    def get_library_artwork_cached_crumb_pb(self, cache_key, size):
+        filename = self.get_library_artwork_cached_filename(cache_key)
+        if filename is None:
+            return None
+        # A new cover can be saved under the same file name: check the file
+        # didn't change since it was scaled
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            mtime = None
+        cached = self.crumb_cache.get(cache_key)
+        if cached is not None and cached[:2] == (filename, mtime):
+            self.crumb_cache.move_to_end(cache_key)
+            return cached[2]
+        pb = self.get_library_artwork_cached_pb(cache_key, None)
+        if pb is None:
+            return None
+        # Bilinear is as good as the slower modes at such a small size
+        pb = pb.scale_simple(size, size, GdkPixbuf.InterpType.BILINEAR)
+        self.crumb_cache[cache_key] = (filename, mtime, pb)
+        while len(self.crumb_cache) > CRUMB_CACHE_SIZE:
+            self.crumb_cache.popitem(last=False)
+        return pb
+
     def artwork_save_cache(self):
         misc.create_dir('~/.config/sonata/')
         filename = os.path.expanduser("~/.config/sonata/art_cache")
@@ -441,7 +516,7 @@ class Artwork(GObject.GObject):
 
         # Also, update row in library:
         if artist is not None:
-            cache_key = library.SongRecord(artist=artist, album=album, path=path)
+            cache_key = (artist, album, path)
             self.set_library_artwork_cached_filename(cache_key,
                                                      self.album_filename)
             GLib.idle_add(self.library_set_image_for_current_song, cache_key)
@@ -478,8 +553,7 @@ class Artwork(GObject.GObject):
 
                 if not info_img_only:
                     # Store in cache
-                    cache_key = library.SongRecord(artist=artist, album=album,
-                                                 path=path)
+                    cache_key = (artist, album, path)
                     self.set_library_artwork_cached_filename(cache_key,
                                                              filename)
 
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import operator
+
 from gi.repository import Gtk, Gdk, Pango
 
 
@@ -10,6 +12,7 @@ class CrumbButton(Gtk.ToggleButton):
         super().__init__()
 
         self.set_properties(can_focus=False, relief=Gtk.ReliefStyle.NONE)
+        self.image = image
         self.label = label
 
         # adapt Gtk.Button internal layout code:
@@ -130,7 +133,7 @@ class CrumbBox(Gtk.Box):
             # We want a descending sort by widths
             # We ellipsize biggest to smallest to preserve the most crumbs
             crumbsorted = [(w.width, crumb) for w, crumb in zip(reqs, crumbs)]
-            sorted(crumbsorted, key=lambda crumb: crumb[0], reverse=True)
+            crumbsorted.sort(key=operator.itemgetter(0), reverse=True)
             for x, crumb in crumbsorted:
                 if crumb.ellipsize():
                     i = crumbs.index(crumb)
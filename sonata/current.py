@@ -1,5 +1,6 @@
 """Handle the mpd current playlist and provides a user interface for it."""
 
+import operator
 import os
 import re
 import urllib.parse, urllib.request
@@ -7,7 +8,6 @@ import urllib.parse, urllib.request
 from gi.repository import Gtk, Gdk, Pango, GLib
 
 from sonata import ui, misc, formatting
-from sonata.mpdhelper import MPDSong
 
 
 class Current:
@@ -129,7 +129,8 @@ class Current:
         # Initialize current playlist data and widget
         self.resizing_columns = False
         self.columnformat = self.config.currentformat.split("|")
-        current_columns = [MPDSong] + [str] * len(self.columnformat) + [int]
+        # The songs are stored as plain Python objects
+        current_columns = [object] + [str] * len(self.columnformat) + [int]
         previous_tracks = (item[0] for item in (self.store or []))
         self.store = Gtk.ListStore(*(current_columns))
         cellrenderer = Gtk.CellRendererText()
@@ -202,6 +203,7 @@ class Current:
         return filenames
 
     def update_format(self, tracks):
+        columns = list(range(self.store.get_n_columns()))
         for i, track in enumerate(tracks):
             items = [formatting.parse(part, track, True)
                      for part in self.columnformat]
@@ -211,7 +213,8 @@ class Current:
             else:
                 weight = [Pango.Weight.NORMAL]
 
-            self.store.append([track] + items + weight)
+            self.store.insert_with_valuesv(-1, columns,
+                                           [track] + items + weight)
 
     @try_keep_position
     def current_update(self, prevstatus_playlist, new_playlist_length):
@@ -230,6 +233,9 @@ class Current:
 
                 newlen = int(new_playlist_length)
                 currlen = len(self.store)
+                # Set all the columns of new rows at once, this is much
+                # cheaper than ListStore.append's per-column conversion
+                columns = list(range(self.store.get_n_columns()))
 
                 for track in changed_songs:
                     pos = track.pos
@@ -247,7 +253,8 @@ class Current:
                                 self.store.set_value(i, index + 1, items[index])
                     else:
                         # Add new item:
-                        self.store.append(
+                        self.store.insert_with_valuesv(
+                            -1, columns,
                             [track] + items + [Pango.Weight.NORMAL])
 
                 if newlen == 0:
@@ -421,7 +428,7 @@ class Current:
                 songs.append(record)
                 track_num = track_num + 1
 
-            songs.sort(key=lambda x: x["sortby"])
+            songs.sort(key=operator.itemgetter("sortby"))
 
             pos = 0
             self.mpd.command_list_ok_begin()
@@ -11,6 +11,7 @@ newtitle = formatting.parse(self.config.titleformat, self.songinfo,
 formatcodes = formatting.formatcodes
 """
 
+import functools
 import re
 import os
 
@@ -117,6 +118,7 @@ formatcodes = [FormatCode('A', _('Artist name'), _("Artist"), 'artist'),
 
 replace_map = dict((code.code, code) for code in formatcodes)
 replace_expr = r"%%[%s]" % "".join(k for k in replace_map.keys())
+replace_group_expr = "(%s)" % replace_expr
 
 
 def _return_substrings(format):
@@ -152,29 +154,43 @@ def parse_colnames(format):
     return cols
 
 
-class EmptyBrackets(Exception):
-    pass
-
-
-def _format_substrings(text, item, wintitle, songpos):
-    has_brackets = text.startswith("{") and text.endswith("}")
-
-    def formatter(m):
-        format_code = replace_map[m.group(0)[1:]]
-        if has_brackets and format_code.key not in item:
-            raise EmptyBrackets
-        return format_code.format(item, wintitle, songpos)
-
-    try:
-        text = re.sub(replace_expr, formatter, text)
-    except EmptyBrackets:
-        return ""
-
-    return text[1:-1] if has_brackets else text
+@functools.lru_cache(maxsize=64)
+def _compile(format):
+    """Split format into the parts to format a song with.
+
+    Returns a tuple of (has_brackets, parts, codes) for each substring,
+    where parts are the text and FormatCodes in order, and codes are the
+    FormatCodes of the substring only. This is done once for each format,
+    since the same few formats are used for every row."""
+    compiled = []
+    for text in _return_substrings(format):
+        has_brackets = text.startswith("{") and text.endswith("}")
+        if has_brackets:
+            text = text[1:-1]
+        parts = []
+        codes = []
+        for i, part in enumerate(re.split(replace_group_expr, text)):
+            if i % 2:
+                code = replace_map[part[1:]]
+                parts.append(code)
+                codes.append(code)
+            elif part:
+                parts.append(part)
+        compiled.append((has_brackets, tuple(parts), tuple(codes)))
+    return tuple(compiled)
 
 
 def parse(format, item, use_escape_html, wintitle=False, songpos=None):
-    substrings = _return_substrings(format)
-    text = "".join(_format_substrings(sub, item, wintitle, songpos)
-            for sub in substrings)
+    texts = []
+    for has_brackets, parts, codes in _compile(format):
+        # A substring in brackets is only shown if the song has all its
+        # values
+        if has_brackets and any(code.key not in item for code in codes):
+            continue
+        for part in parts:
+            if type(part) is str:
+                texts.append(part)
+            else:
+                texts.append(part.format(item, wintitle, songpos))
+    text = "".join(texts)
     return misc.escape_html(text) if use_escape_html else text
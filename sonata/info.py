@@ -2,6 +2,7 @@ import sys
 import os
 import locale
 import logging
+import operator
 import threading
 
 from gi.repository import Gtk, Pango, Gdk, GdkPixbuf, GLib
@@ -274,7 +275,7 @@ class Info:
         albuminfo = _("Album info not found.")
 
         if tracks:
-            tracks.sort(key=lambda x: x.track)
+            tracks.sort(key=operator.attrgetter('track'))
             playtime = 0
             tracklist = []
             for t in tracks:
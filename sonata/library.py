@@ -1,7 +1,10 @@
 import os
-import re
+import functools
 import gettext
 import locale
+import logging
+import pickle
+import sys
 import threading # libsearchfilter_toggle starts thread libsearchfilter_loop
 import operator
 
@@ -11,36 +14,81 @@ from sonata import ui, misc, consts, formatting, breadcrumbs, mpdhelper as mpdh
 from sonata.song import SongRecord
 
 
+logger = logging.getLogger(__name__)
+
 VARIOUS_ARTISTS = _("Various Artists")
+VIEW_CACHE_FILE = "~/.config/sonata/library_cache"
+# Number of rows added to the library list between two main loop iterations
+POPULATE_BATCH_SIZE = 500
+# The top level of every view
+ROOT = SongRecord(path="/")
+DISPLAY_INFO_MARKUP = "\n<small><span weight='light'>{}</span></small>"
 
 
 def list_mark_various_artists_albums(albums):
-    for i in range(len(albums)):
-        if i + consts.NUM_ARTISTS_FOR_VA - 1 > len(albums)-1:
-            break
-        VA = False
-        for j in range(1, consts.NUM_ARTISTS_FOR_VA):
-            if albums[i].album.lower() != albums[i + j].album.lower() or \
-               albums[i].year  != albums[i + j].year or \
-               albums[i].path  != albums[i + j].path:
-                break
-            if albums[i].artist == albums[i + j].artist:
-                albums.pop(i + j)
-                break
-            if j == consts.NUM_ARTISTS_FOR_VA - 1:
-                VA = True
-        if VA:
-            albums[i].artist = VARIOUS_ARTISTS
-            j = 1
-            while i + j <= len(albums) - 1:
-                if albums[i].album.lower() == albums[i + j].album.lower() \
-                   and albums[i].year == albums[i + j].year:
-                    albums.pop(i + j)
-                else:
-                    break
+    # Albums are grouped by runs of consecutive entries sharing the same
+    # album, year and path; a run is collapsed into a single "Various
+    # Artists" entry when it holds enough distinct artists.
+    albums_lower = [album.album.lower() for album in albums]
+    results = []
+    i = 0
+    count = len(albums)
+    while i < count:
+        first = albums[i]
+        k = i + 1
+        while k < count and albums_lower[k] == albums_lower[i] and \
+              albums[k].year == first.year and albums[k].path == first.path:
+            k += 1
+        artists = {albums[m].artist for m in range(i, k)}
+        if len(artists) >= consts.NUM_ARTISTS_FOR_VA > 1:
+            first.artist = VARIOUS_ARTISTS
+            results.append(first)
+            # Also swallow the same album found in other directories
+            while k < count and albums_lower[k] == albums_lower[i] and \
+                  albums[k].year == first.year:
+                k += 1
+        else:
+            seen = set()
+            for m in range(i, k):
+                if albums[m].artist not in seen:
+                    seen.add(albums[m].artist)
+                    results.append(albums[m])
+        i = k
+    albums[:] = results
     return albums
 
 
+def intern_tag(value):
+    # The same tag values come up for many songs and albums: share them.
+    # Tags with several values are lists, which can't be interned.
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+# Cached: many rows share the same small song counts and play times
+@functools.lru_cache(maxsize=4096)
+def add_display_info(num_songs, playtime):
+    seconds = int(playtime)
+    hours   = seconds // 3600
+    seconds -= 3600 * hours
+    minutes = seconds // 60
+    seconds -= 60 * minutes
+    # Only translate the parts which are displayed
+    time_parts = [ngettext('{count} song', '{count} songs',
+                           num_songs).format(count=num_songs)]
+    if hours > 0:
+        time_parts.append(ngettext('{count} hour', '{count} hours',
+                                   hours).format(count=hours))
+    if hours > 0 or minutes > 0:
+        time_parts.append(ngettext('{count} minute', '{count} minutes',
+                                   minutes).format(count=minutes))
+    if hours == 0:
+        time_parts.append(ngettext('{count} second', '{count} seconds',
+                                   seconds).format(count=seconds))
+    return DISPLAY_INFO_MARKUP.format(', '.join(time_parts))
+
+
 class Library:
     def __init__(self, config, mpd, artwork, TAB_LIBRARY, settings_save,
                  filter_key_pressed, on_add_item, connected,
@@ -64,7 +112,10 @@ class Library:
 
         self.libfilterbox_cmd_buf = None
         self.libfilterbox_cond = None
+        # Asks the filter thread to drop its connection to mpd
+        self.libfilterbox_reset = False
         self.libfilterbox_source = None
+        self.libfilterbox_deadline = 0
 
         self.prevlibtodo_base = None
         self.prevlibtodo_base_results = None
@@ -72,15 +123,23 @@ class Library:
 
         self.save_timeout = None
         self.libsearch_last_tooltip = None
+        self.library_populate_source = None
+        self.library_scrolled_source = None
 
         self.lib_view_filesystem_cache = None
         self.lib_view_artist_cache = None
         self.lib_view_genre_cache = None
         self.lib_view_album_cache = None
-        self.lib_list_genres = None
-        self.lib_list_artists = None
-        self.lib_list_albums = None
-        self.lib_list_years = None
+        # Case variants of the genres/artists/albums/years, by tag name
+        self.lib_list_variants = {}
+        self.lib_list_items_cache = {}
+        # Count/search results memoized while a view is being built
+        self.lib_query_memo = None
+        # Whether a query failed while building the view: its results are
+        # incomplete and mustn't be cached
+        self.lib_query_failed = False
+        self.lib_view_caches_loaded = False
+        self.lib_view_caches_stamp = None
         self.view_caches_reset()
 
         # Library tab
@@ -99,6 +158,8 @@ class Library:
             'library_crumb_break_box')
         self.breadcrumbs.set_crumb_break(self.crumb_break)
         self.crumb_section_handler = None
+        # (crumb, button, toggled handler) of each crumb button shown
+        self.crumb_buttons = []
         expanderwindow2 = self.builder.get_object('library_page_scrolledwindow')
         self.searchbox = self.builder.get_object('library_page_searchbox')
         self.searchcombo = self.builder.get_object('library_page_searchbox_combo')
@@ -166,8 +227,7 @@ class Library:
         self.searchcombo.handler_block(searchcombo_changed_handler)
         self.searchcombo.set_active(self.config.last_search_num)
         self.searchcombo.handler_unblock(searchcombo_changed_handler)
-        self.librarydata = Gtk.ListStore(GdkPixbuf.Pixbuf,
-                                         GObject.TYPE_PYOBJECT, str)
+        self.librarydata = self.library_new_model()
         self.library.set_model(self.librarydata)
         self.library.set_search_column(2)
         self.librarycell = Gtk.CellRendererText()
@@ -178,7 +238,10 @@ class Library:
         self.librarycolumn.pack_start(self.librarycell, True)
         self.librarycolumn.add_attribute(self.libraryimg, 'pixbuf', 0)
         self.librarycolumn.add_attribute(self.librarycell, 'markup', 2)
-        self.librarycolumn.set_sizing(Gtk.TreeViewColumnSizing.AUTOSIZE)
+        # The rows are ellipsized to the width of the view anyway: a fixed
+        # size column spares measuring the width of every row of the model
+        self.librarycolumn.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        self.librarycolumn.set_expand(True)
         self.library.append_column(self.librarycolumn)
         self.library_selection.set_mode(Gtk.SelectionMode.MULTIPLE)
 
@@ -190,6 +253,9 @@ class Library:
     def get_model(self):
         return self.librarydata
 
+    def library_new_model(self):
+        return Gtk.ListStore(GdkPixbuf.Pixbuf, GObject.TYPE_PYOBJECT, str)
+
     def get_widgets(self):
         return self.libraryvbox
 
@@ -227,7 +293,7 @@ class Library:
         self.library.grab_focus()
         self.libraryposition = {}
         self.libraryselectedpath = {}
-        self.library_browse(root=SongRecord(path="/"))
+        self.library_browse(root=ROOT)
         try:
             if len(self.librarydata) > 0:
                 first = Gtk.TreePath.new_first()
@@ -246,21 +312,102 @@ class Library:
         self.lib_view_artist_cache = None
         self.lib_view_genre_cache = None
         self.lib_view_album_cache = None
-        self.lib_list_genres = None
-        self.lib_list_artists = None
-        self.lib_list_albums = None
-        self.lib_list_years = None
-
-    def on_library_scrolled(self, _widget, _event):
+        # Case variants of the genres/artists/albums/years, by tag name
+        self.lib_list_variants = {}
+        self.lib_list_items_cache = {}
+        # Drop the names of the previous database from the sort memos
+        misc.lower_no_the.cache_clear()
+        misc.get_sort_key.cache_clear()
+        # Give the on-disk caches a chance to replace the ones we just dropped
+        self.lib_view_caches_loaded = False
+        self.lib_view_caches_stamp = None
+
+    def view_caches_stamp(self):
+        # The toplevel caches are only valid for the database they were built
+        # from, sorted and labelled using the same locale. It's asked once
+        # until the caches are reset, for both loading and saving them.
+        if self.lib_view_caches_stamp is None:
+            stats = self.mpd.stats()
+            if not stats:
+                return None
+            self.lib_view_caches_stamp = (stats.get('db_update'),
+                                          locale.setlocale(locale.LC_COLLATE),
+                                          misc.get_sort_key_backend(),
+                                          self.NOTAG)
+        return self.lib_view_caches_stamp
+
+    def view_caches_save(self):
+        caches = {}
+        for name, bd in (('genre', self.lib_view_genre_cache),
+                         ('artist', self.lib_view_artist_cache),
+                         ('album', self.lib_view_album_cache)):
+            if bd is not None:
+                # Pixbufs can't be pickled, they are restored on load
+                caches[name] = [(sort, (None, data, display))
+                                for sort, (_pb, data, display) in bd]
+        if not caches:
+            return
+        stamp = self.view_caches_stamp()
+        if stamp is None:
+            return
+        misc.create_dir('~/.config/sonata/')
+        filename = os.path.expanduser(VIEW_CACHE_FILE)
         try:
-            # Use GLib.idle_add so that we can get the visible
-            # state of the treeview
-            GLib.idle_add(self._on_library_scrolled)
-        except:
+            with open(filename, 'wb') as f:
+                pickle.dump((stamp, caches), f, pickle.HIGHEST_PROTOCOL)
+        except (IOError, pickle.PickleError):
             pass
 
+    def view_caches_load(self):
+        self.lib_view_caches_loaded = True
+        filename = os.path.expanduser(VIEW_CACHE_FILE)
+        if not os.path.exists(filename):
+            return
+        try:
+            with open(filename, 'rb') as f:
+                stamp, caches = pickle.load(f)
+            current = self.view_caches_stamp()
+            if current is None:
+                # Can't tell whether the cache is still valid: keep it, and
+                # try again next time
+                self.lib_view_caches_loaded = False
+                return
+            if stamp != current:
+                # The database has changed since, this cache is useless now
+                misc.remove_file(filename)
+                return
+            loaded = {}
+            for name, pb in (('genre', self.genrepb),
+                             ('artist', self.artistpb),
+                             ('album', self.albumpb)):
+                if name in caches:
+                    loaded[name] = [(sort, (pb, data, display))
+                                    for sort, (_pb, data, display)
+                                    in caches[name]]
+        except Exception as e:
+            # Damaged, or written by another version of Sonata
+            logger.warning("Discarding the library cache %s: %s", filename, e)
+            misc.remove_file(filename)
+            return
+        if self.lib_view_genre_cache is None:
+            self.lib_view_genre_cache = loaded.get('genre')
+        if self.lib_view_artist_cache is None:
+            self.lib_view_artist_cache = loaded.get('artist')
+        if self.lib_view_album_cache is None:
+            self.lib_view_album_cache = loaded.get('album')
+
+    def on_library_scrolled(self, _widget, _event):
+        # Wait for the scrolling to settle before updating the artwork, so
+        # that a burst of scroll events only triggers one update. This also
+        # lets us get the visible state of the treeview.
+        if self.library_scrolled_source is not None:
+            GLib.source_remove(self.library_scrolled_source)
+        self.library_scrolled_source = GLib.timeout_add(
+            50, self._on_library_scrolled)
+
     def _on_library_scrolled(self):
-        if not self.config.show_covers:
+        self.library_scrolled_source = None
+        if not self.config.show_covers or not self.library_view_has_albums():
             return
 
         # This avoids a warning about a NULL node in get_visible_range
@@ -277,61 +424,65 @@ class Library:
         self.artwork.library_artwork_update(self.librarydata, start_row,
                                             end_row, self.albumpb)
 
+    def library_view_has_albums(self):
+        # Only album rows get artwork: don't go through the rows of the
+        # views which can't have any.
+        wd = self.config.wd
+        if self.config.lib_view == consts.VIEW_ALBUM:
+            return wd.album is None
+        elif self.config.lib_view in (consts.VIEW_ARTIST, consts.VIEW_GENRE):
+            return wd.artist is not None and wd.album is None
+        return False
+
     def library_browse(self, _widget=None, root=None):
         # Populates the library list with entries
         if not self.connected():
             return
 
-        if root is None or (self.config.lib_view == consts.VIEW_FILESYSTEM \
-                            and root.path is None):
-            root = SongRecord(path="/")
-        if self.config.wd is None or (self.config.lib_view == \
-                                      consts.VIEW_FILESYSTEM and \
+        is_filesystem = self.config.lib_view == consts.VIEW_FILESYSTEM
+        if root is None or (is_filesystem and root.path is None):
+            root = ROOT
+        if self.config.wd is None or (is_filesystem and
                                       self.config.wd.path is None):
-            self.config.wd = SongRecord(path="/")
+            self.config.wd = ROOT
+        prev_wd = self.config.wd
 
         prev_selection = []
         prev_selection_root = False
         prev_selection_parent = False
-        if root == self.config.wd:
+        path_updated = root == prev_wd
+        new_level = self.library_get_data_level(root)
+        curr_level = self.library_get_data_level(prev_wd)
+        if path_updated or new_level > curr_level:
+            position = self.library.get_visible_rect().width
+        if path_updated:
             # This will happen when the database is updated. So, lets save
             # the current selection in order to try to re-select it after
             # the update is over.
             model, selected = self.library_selection.get_selected_rows()
             for path in selected:
                 prev_selection.append(model.get_value(model.get_iter(path), 1))
-            self.libraryposition[self.config.wd] = \
-                    self.library.get_visible_rect().width
-            path_updated = True
-        else:
-            path_updated = False
+            self.libraryposition[prev_wd] = position
 
-        new_level = self.library_get_data_level(root)
-        curr_level = self.library_get_data_level(self.config.wd)
         # The logic below is more consistent with, e.g., thunar.
         if new_level > curr_level:
             # Save position and row for where we just were if we've
             # navigated into a sub-directory:
-            self.libraryposition[self.config.wd] = \
-                    self.library.get_visible_rect().width
-            model, rows = self.library_selection.get_selected_rows()
+            self.libraryposition[prev_wd] = position
+            _model, rows = self.library_selection.get_selected_rows()
             if len(rows) > 0:
-                data = self.librarydata.get_value(
-                    self.librarydata.get_iter(rows[0]), 2)
-                self.libraryselectedpath[self.config.wd] = rows[0]
-        elif (self.config.lib_view == consts.VIEW_FILESYSTEM and \
-              root != self.config.wd) \
-        or (self.config.lib_view != consts.VIEW_FILESYSTEM and new_level != \
-            curr_level):
+                self.libraryselectedpath[prev_wd] = rows[0]
+        elif (is_filesystem and not path_updated) \
+        or (not is_filesystem and new_level != curr_level):
             # If we've navigated to a parent directory, don't save
             # anything so that the user will enter that subdirectory
             # again at the top position with nothing selected
-            self.libraryposition[self.config.wd] = 0
-            self.libraryselectedpath[self.config.wd] = None
+            self.libraryposition[prev_wd] = 0
+            self.libraryselectedpath[prev_wd] = None
 
         # In case sonata is killed or crashes, we'll save the library state
         # in 5 seconds (first removing any current settings_save timeouts)
-        if self.config.wd != root:
+        if not path_updated:
             try:
                 GLib.source_remove(self.save_timeout)
             except:
@@ -339,13 +490,31 @@ class Library:
             self.save_timeout = GLib.timeout_add(5000, self.settings_save)
 
         self.config.wd = root
-        self.library.freeze_child_notify()
-        self.librarydata.clear()
+        self.library_populate_cancel()
+        # Replacing the model is cheaper than clearing it, which emits a
+        # signal for each row removed. It gets attached to the tree view
+        # once its first rows are in.
+        self.librarydata = self.library_new_model()
+
+        # Populate treeview with data. The same counts and searches are
+        # often needed several times while building a view.
+        self.lib_query_memo = {}
+        self.lib_query_failed = False
+        try:
+            bd = self.library_populate_view()
+        finally:
+            self.lib_query_memo = None
+
+        self.library_populate_start(bd, (bd, path_updated, prev_selection,
+                                         prev_selection_root,
+                                         prev_selection_parent))
+
+        self.update_breadcrumbs()
 
-        # Populate treeview with data:
+    def library_populate_view(self):
         bd = []
-        wd = self.config.wd
         while len(bd) == 0:
+            wd = self.config.wd
             if self.config.lib_view == consts.VIEW_FILESYSTEM:
                 bd = self.library_populate_filesystem_data(wd.path)
             elif self.config.lib_view == consts.VIEW_ALBUM:
@@ -360,7 +529,7 @@ class Library:
                     bd = self.library_populate_data(artist=wd.artist,
                                                     album=wd.album,
                                                     year=wd.year)
-                elif self.config.wd.artist is not None:
+                elif wd.artist is not None:
                     bd = self.library_populate_data(artist=wd.artist)
                 else:
                     bd = self.library_populate_toplevel_data(artistview=True)
@@ -385,31 +554,65 @@ class Library:
                 self.config.wd = self.library_get_parent()
                 if self.config.wd == last_wd:
                     break
+        return bd
 
-        for _sort, path in bd:
-            self.librarydata.append(path)
+    def library_insert_rows(self, bd):
+        # Set all the columns of each row at once, without going through
+        # ListStore.append's per-row conversion
+        model = self.librarydata
+        columns = list(range(model.get_n_columns()))
+        # Nothing is watching the model yet, so adding the first rows
+        # doesn't notify the tree view of each of them
+        for _sort, row in bd[:POPULATE_BATCH_SIZE]:
+            model.insert_with_valuesv(-1, columns, row)
+        self.library.set_model(model)
+        self.artwork.library_artwork_set_model(model)
+        for start in range(POPULATE_BATCH_SIZE, len(bd), POPULATE_BATCH_SIZE):
+            yield
+            for _sort, row in bd[start:start + POPULATE_BATCH_SIZE]:
+                model.insert_with_valuesv(-1, columns, row)
+
+    def library_populate_start(self, bd, args):
+        # The first rows are shown right away, the rest of them are added
+        # from the main loop so that big views don't freeze the interface.
+        # library_populated is called with args once they are all in.
+        rows = self.library_insert_rows(bd)
+        if self.library_populate_step(rows, args):
+            self.library_populate_source = GLib.idle_add(
+                self.library_populate_step, rows, args)
+
+    def library_populate_step(self, rows, args):
+        # Insert the next batch of rows, returns True if there are more to
+        # come, so that it can be used as a GLib source.
+        try:
+            next(rows)
+            return True
+        except StopIteration:
+            self.library_populate_source = None
+            self.library_populated(*args)
+            return False
 
-        self.library.thaw_child_notify()
+    def library_populate_cancel(self):
+        if self.library_populate_source is not None:
+            GLib.source_remove(self.library_populate_source)
+            self.library_populate_source = None
 
+    def library_populated(self, bd, path_updated, prev_selection,
+                          prev_selection_root, prev_selection_parent):
         # Scroll back to set view for current dir:
         self.library.realize()
         GLib.idle_add(self.library_set_view, not path_updated)
         if len(prev_selection) > 0 or prev_selection_root or \
            prev_selection_parent:
             # Retain pre-update selection:
-            self.library_retain_selection(prev_selection, prev_selection_root,
+            self.library_retain_selection(bd, prev_selection,
+                                          prev_selection_root,
                                           prev_selection_parent)
 
         # Update library artwork as necessary
         self.on_library_scrolled(None, None)
 
-        self.update_breadcrumbs()
-
     def update_breadcrumbs(self):
-        # remove previous buttons
-        for b in self.breadcrumbs:
-            self.breadcrumbs.remove(b)
-
         # find info for current view
         view, _name, icon, label = [v for v in self.VIEWS
                           if v[0] == self.config.lib_view][0]
@@ -455,11 +658,8 @@ class Library:
                 pb, icon = None, None
                 if key == 'album':
                     # Album artwork, with self.alumbpb as a backup:
-                    cache_data = SongRecord(artist=self.config.wd.artist,
-                                            album=self.config.wd.album,
-                                            path=self.config.wd.path)
-                    pb = self.artwork.get_library_artwork_cached_pb(cache_data,
-                                                                    None)
+                    pb = self.artwork.get_library_artwork_cached_crumb_pb(
+                        self.config.wd.artwork_key(), 16)
                     if pb is None:
                         icon = 'album'
                 elif key == 'artist':
@@ -478,19 +678,43 @@ class Library:
             context.remove_class('last_crumb')
 
         self.crumb_section_handler = self.crumb_section.connect('toggled',
-            self.library_browse, SongRecord(path='/'))
+            self.library_browse, ROOT)
+
+        # Reuse the buttons of the previous crumbs, updating the ones which
+        # changed, and remove the extra ones
+        kept = min(len(self.crumb_buttons), len(crumbs))
+        for _crumb, b, _handler in self.crumb_buttons[kept:]:
+            self.breadcrumbs.remove(b)
+        del self.crumb_buttons[kept:]
+
+        for i, crumb in enumerate(crumbs[:kept]):
+            old_crumb, b, handler = self.crumb_buttons[i]
+            if crumb != old_crumb:
+                text, icon, pb, target = crumb
+                b.label.set_markup(misc.escape_html(text))
+                b.set_tooltip_text(b.label.get_label())
+                self.crumb_image_set(b.image, icon, pb)
+                b.disconnect(handler)
+                handler = b.connect('toggled', self.library_browse, target)
+                self.crumb_buttons[i] = (crumb, b, handler)
+            # The last crumb is displayed as the active one
+            is_last = i == len(crumbs) - 1
+            b.handler_block(handler)
+            b.set_active(is_last)
+            b.handler_unblock(handler)
+            context = b.get_style_context()
+            if is_last:
+                context.add_class('last_crumb')
+            else:
+                context.remove_class('last_crumb')
 
-        # add a button for each crumb
-        for crumb in crumbs:
+        # add a button for each new crumb
+        for crumb in crumbs[kept:]:
             text, icon, pb, target = crumb
             text = misc.escape_html(text)
             label = Gtk.Label(text, use_markup=True)
-
-            if icon:
-                image = Gtk.Image.new_from_stock(icon, Gtk.IconSize.MENU)
-            elif pb:
-                pb = pb.scale_simple(16, 16, GdkPixbuf.InterpType.HYPER)
-                image = Gtk.Image.new_from_pixbuf(pb)
+            image = Gtk.Image()
+            self.crumb_image_set(image, icon, pb)
 
             b = breadcrumbs.CrumbButton(image, label)
 
@@ -501,12 +725,20 @@ class Library:
                 context.add_class('last_crumb')
 
             b.set_tooltip_text(label.get_label())
-            b.connect('toggled', self.library_browse, target)
+            handler = b.connect('toggled', self.library_browse, target)
+            self.crumb_buttons.append((crumb, b, handler))
             self.breadcrumbs.pack_start(b, False, False, 0)
             b.show_all()
 
+    def crumb_image_set(self, image, icon, pb):
+        if icon:
+            image.set_from_stock(icon, Gtk.IconSize.MENU)
+        elif pb:
+            image.set_from_pixbuf(pb)
+
     def library_populate_filesystem_data(self, path):
-        # List all dirs/files at path
+        # List all dirs/files at path, directories first, each sorted
+        # according to the locale like the other views
         bd = []
         if path == '/' and self.lib_view_filesystem_cache is not None:
             # Use cache if possible...
@@ -516,19 +748,21 @@ class Library:
                 if 'directory' in item:
                     name = os.path.basename(item['directory'])
                     data = SongRecord(path=item["directory"])
-                    bd += [('d' + str(name).lower(), [self.openpb, data,
-                                                      misc.escape_html(name)])]
+                    bd.append((('d', misc.get_sort_key(name.lower())),
+                               (self.openpb, data, misc.escape_html(name))))
                 elif 'file' in item:
                     data = SongRecord(path=item['file'])
-                    bd += [('f' + item['file'].lower(),
-                            [self.sonatapb, data,
-                             formatting.parse(self.config.libraryformat, item,
-                                              True)])]
+                    bd.append((('f', misc.get_sort_key(item['file'].lower())),
+                               (self.sonatapb, data,
+                                formatting.parse(self.config.libraryformat,
+                                                 item, True))))
             bd.sort(key=operator.itemgetter(0))
         return bd
 
     def library_get_toplevel_cache(self, genreview=False, artistview=False,
                                    albumview=False):
+        if not self.lib_view_caches_loaded:
+            self.view_caches_load()
         if genreview and self.lib_view_genre_cache is not None:
             bd = self.lib_view_genre_cache
         elif artistview and self.lib_view_artist_cache is not None:
@@ -537,15 +771,8 @@ class Library:
             bd = self.lib_view_album_cache
         else:
             return None
-        # Check if we can update any artwork:
-        for _sort, info in bd:
-            pb = info[0]
-            if pb == self.albumpb:
-                key = SongRecord(path=info[1].path, artist=info[1].artist,
-                                 album=info[1].album)
-                pb2 = self.artwork.get_library_artwork_cached_pb(key, None)
-                if pb2 is not None:
-                    info[0] = pb2
+        # The album rows show the default icon, their artwork is loaded by
+        # the artwork thread once they are in the model.
         return bd
 
     def library_populate_toplevel_data(self, genreview=False, artistview=False,
@@ -566,42 +793,30 @@ class Library:
                 pb = self.artistpb
             if not (self.NOTAG in items):
                 items.append(self.NOTAG)
-            for item in items:
-                if genreview:
-                    playtime, num_songs = self.library_return_count(genre=item)
-                    data = SongRecord(genre=item)
-                else:
-                    playtime, num_songs = self.library_return_count(
-                        artist=item)
-                    data = SongRecord(artist=item)
+            if genreview:
+                queries = [{'genre': item} for item in items]
+            else:
+                queries = [{'artist': item} for item in items]
+            counts = self.library_return_counts(queries)
+            for item, query, (playtime, num_songs) in zip(items, queries,
+                                                          counts):
                 if num_songs > 0:
-                    display = misc.escape_html(item)
-                    display += self.add_display_info(num_songs, playtime)
-                    bd += [(misc.lower_no_the(item), [pb, data, display])]
+                    data = SongRecord(**query)
+                    display = misc.escape_html(item) + \
+                            add_display_info(num_songs, playtime)
+                    bd.append((misc.get_sort_key(misc.lower_no_the(item)),
+                               (pb, data, display)))
         elif albumview:
-            albums = []
-            untagged_found = False
-            for item in self.mpd.listallinfo('/'):
-                if 'file' in item and 'album' in item:
-                    album = item['album']
-                    artist = item.get('artist', self.NOTAG)
-                    year = item.get('date', self.NOTAG)
-                    path = self.get_multicd_album_root_dir(
-                        os.path.dirname(item['file']))
-                    data = SongRecord(album=album, artist=artist,
-                                      year=year, path=path)
-                    albums.append(data)
-                    if album == self.NOTAG:
-                        untagged_found = True
-            if not untagged_found:
+            albums = self.library_return_albums()
+            if not any(item.album == self.NOTAG for item in albums):
                 albums.append(SongRecord(album=self.NOTAG))
             albums = misc.remove_list_duplicates(albums, case=False)
             albums = list_mark_various_artists_albums(albums)
-            for item in albums:
+            counts = self.library_return_counts(
+                [{'artist': item.artist, 'album': item.album,
+                  'year': item.year} for item in albums])
+            for item, (playtime, num_songs) in zip(albums, counts):
                 album, artist, _genre, year, path = item
-                playtime, num_songs = self.library_return_count(artist=artist,
-                                                                album=album,
-                                                                year=year)
                 if num_songs > 0:
                     data = SongRecord(artist=artist, album=album,
                                            year=year, path=path)
@@ -617,10 +832,13 @@ class Library:
                     elif year and len(year) > 0 and year != self.NOTAG:
                         display += " <span weight='light'>(%s)</span>" \
                                 % misc.escape_html(year)
-                    display += self.add_display_info(num_songs, playtime)
-                    bd += [(misc.lower_no_the(album), [self.albumpb, data,
-                                                       display])]
-        bd.sort(key=lambda key: locale.strxfrm(key[0]))
+                    display += add_display_info(num_songs, playtime)
+                    bd.append((misc.get_sort_key(misc.lower_no_the(album)),
+                               (self.albumpb, data, display)))
+        bd.sort(key=operator.itemgetter(0))
+        if self.lib_query_failed:
+            # Don't keep (or save) a view missing the rows of failed queries
+            return bd
         if genreview:
             self.lib_view_genre_cache = bd
         elif artistview:
@@ -630,6 +848,89 @@ class Library:
         return bd
 
 
+    def library_return_albums(self):
+        # Returns a SongRecord for each album, artist, year and directory
+        # found in the database.
+        groups = []
+        if self.mpd.version >= (0, 19):
+            # Let mpd group the albums instead of transferring the whole
+            # database: only the file names are needed to find their paths
+            groups = self.mpd.list('album', 'group', 'artist', 'group', 'date')
+        if not groups or not isinstance(groups[0], dict):
+            # Either grouping isn't supported by mpd, or python-mpd doesn't
+            # return the grouped tags
+            return self.library_return_albums_from_songs()
+
+        queries = []
+        list_queries = []
+        find_queries = []
+        for group in groups:
+            if group.get('album'):
+                album = group['album']
+                artist = group.get('artist') or ''
+                year = group.get('date') or ''
+                queries.append((album, artist, year))
+                if artist and year:
+                    list_queries.append(('file', 'album', album,
+                                         'artist', artist, 'date', year))
+                else:
+                    # 'list' doesn't return anything for untagged tags
+                    # (''): find the songs of the album instead, and keep
+                    # those which don't have the missing tags.
+                    find_query = ('album', album)
+                    if artist:
+                        find_query += ('artist', artist)
+                    if year:
+                        find_query += ('date', year)
+                    find_queries.append(find_query)
+        list_results = self.mpd.command_list('list', list_queries)
+        find_results = self.mpd.command_list('find', find_queries)
+        if list_results is None or find_results is None:
+            return self.library_return_albums_from_songs()
+        list_results = iter(list_results)
+        find_results = iter(find_results)
+
+        albums = []
+        for album, artist, year in queries:
+            if artist and year:
+                files = [item['file'] if isinstance(item, dict) else item
+                         for item in next(list_results)]
+            else:
+                files = [item['file'] for item in next(find_results)
+                         if 'file' in item and
+                         (artist or not item.get('artist')) and
+                         (year or not item.get('date'))]
+            artist = artist or self.NOTAG
+            year = year or self.NOTAG
+            paths = set()
+            for item in files:
+                paths.add(self.get_multicd_album_root_dir(
+                    os.path.dirname(item)))
+            album = intern_tag(album)
+            artist = intern_tag(artist)
+            year = intern_tag(year)
+            for path in paths:
+                albums.append(SongRecord(album=album, artist=artist,
+                                         year=year, path=sys.intern(path)))
+        # Various Artists albums are found from consecutive entries, as
+        # they are when listing all the songs
+        albums.sort(key=lambda item: (item.path, item.album.lower(),
+                                      item.year))
+        return albums
+
+    def library_return_albums_from_songs(self):
+        albums = []
+        for item in self.mpd.listallinfo('/'):
+            if 'file' in item and 'album' in item:
+                album = intern_tag(item['album'])
+                artist = intern_tag(item.get('artist', self.NOTAG))
+                year = intern_tag(item.get('date', self.NOTAG))
+                path = sys.intern(self.get_multicd_album_root_dir(
+                    os.path.dirname(item['file'])))
+                albums.append(SongRecord(album=album, artist=artist,
+                                         year=year, path=path))
+        return albums
+
     def library_populate_data(self, genre=None, artist=None, album=None,
                               year=None):
         # Create treeview model info
@@ -640,77 +941,59 @@ class Library:
             if len(artists) > 0:
                 if not self.NOTAG in artists:
                     artists.append(self.NOTAG)
-                for artist in artists:
-                    playtime, num_songs = self.library_return_count(
-                        genre=genre, artist=artist)
+                counts = self.library_return_counts(
+                    [{'genre': genre, 'artist': artist} for artist in artists])
+                for artist, (playtime, num_songs) in zip(artists, counts):
                     if num_songs > 0:
-                        display = misc.escape_html(artist)
-                        display += self.add_display_info(num_songs, playtime)
+                        display = misc.escape_html(artist) + \
+                                add_display_info(num_songs, playtime)
                         data = SongRecord(genre=genre, artist=artist)
-                        bd += [(misc.lower_no_the(artist),
-                                [self.artistpb, data, display])]
+                        sort_key = misc.get_sort_key(
+                            misc.lower_no_the(artist))
+                        bd.append((sort_key, (self.artistpb, data, display)))
         elif artist is not None and album is None:
             # Albums/songs within an artist and possibly genre
-            # Albums first:
-            if genre is not None:
-                albums = self.library_return_list_items('album', genre=genre,
-                                                        artist=artist)
-            else:
-                albums = self.library_return_list_items('album', artist=artist)
+            # Albums first. Passing genre=None is the same as leaving it out,
+            # so the same queries serve both the artist and genre views.
+            albums = self.library_return_list_items('album', genre=genre,
+                                                    artist=artist)
             for album in albums:
-                if genre is not None:
-                    years = self.library_return_list_items('date', genre=genre,
-                                                           artist=artist,
-                                                           album=album)
-                else:
-                    years = self.library_return_list_items('date',
-                                                           artist=artist,
-                                                           album=album)
+                years = self.library_return_list_items('date', genre=genre,
+                                                       artist=artist,
+                                                       album=album)
                 if not self.NOTAG in years:
                     years.append(self.NOTAG)
+                display_album = misc.escape_html(album)
+                sort_album = misc.lower_no_the(album)
                 for year in years:
-                    if genre is not None:
-                        playtime, num_songs = self.library_return_count(
-                            genre=genre, artist=artist, album=album, year=year)
-                        if num_songs > 0:
-                            files = self.library_return_list_items(
-                                'file', genre=genre, artist=artist,
-                                album=album, year=year)
-                            path = os.path.dirname(files[0])
-                            data = SongRecord(genre=genre, artist=artist,
-                                              album=album, year=year, path=path)
-                    else:
-                        playtime, num_songs = self.library_return_count(
-                            artist=artist, album=album, year=year)
-                        if num_songs > 0:
-                            files = self.library_return_list_items(
-                                'file', artist=artist, album=album, year=year)
-                            path = os.path.dirname(files[0])
-                        cache_data = SongRecord(artist=artist, album=album,
-                                                path=path)
-                        data = SongRecord(artist=artist, album=album,
-                                          year=year, path=path)
-                    if num_songs > 0:
-                        cache_data = SongRecord(artist=artist, album=album, path=path)
-                        display = misc.escape_html(album)
-                        if year and len(year) > 0 and year != self.NOTAG:
-                            display += " <span weight='light'>(%s)</span>" \
-                                    % misc.escape_html(year)
-                        display += self.add_display_info(num_songs, playtime)
-                        ordered_year = year
-                        if ordered_year == self.NOTAG:
-                            ordered_year = '9999'
-                        pb = self.artwork.get_library_artwork_cached_pb(
-                            cache_data, self.albumpb)
-                        bd += [(ordered_year + misc.lower_no_the(album),
-                                [pb, data, display])]
+                    playtime, num_songs = self.library_return_count(
+                        genre=genre, artist=artist, album=album, year=year)
+                    if num_songs == 0:
+                        continue
+                    files = self.library_return_list_items(
+                        'file', genre=genre, artist=artist, album=album,
+                        year=year)
+                    path = sys.intern(os.path.dirname(files[0]))
+                    data = SongRecord(genre=genre, artist=artist, album=album,
+                                      year=year, path=path)
+                    display = display_album
+                    if year and len(year) > 0 and year != self.NOTAG:
+                        display += " <span weight='light'>(%s)</span>" \
+                                % misc.escape_html(year)
+                    display += add_display_info(num_songs, playtime)
+                    ordered_year = year
+                    if ordered_year == self.NOTAG:
+                        ordered_year = '9999'
+                    # The artwork thread replaces the icon with the cover
+                    bd.append((misc.get_sort_key(ordered_year + sort_album),
+                               (self.albumpb, data, display)))
             # Now, songs not in albums:
             bd += self.library_populate_data_songs(genre, artist, self.NOTAG,
                                                    None)
         else:
             # Songs within an album, artist, year, and possibly genre
             bd += self.library_populate_data_songs(genre, artist, album, year)
-        bd.sort(key=lambda key: locale.strxfrm(key[0]))
+        bd.sort(key=operator.itemgetter(0))
         return bd
 
     def library_populate_data_songs(self, genre, artist, album, year):
@@ -726,52 +1009,78 @@ class Library:
             data = SongRecord(path=song.file)
             track = str(song.get('track', 99)).zfill(2)
             disc = str(song.get('disc', 99)).zfill(2)
-            try:
-                bd += [('f' + disc + track + misc.lower_no_the(song.title),
-                        [self.sonatapb, data, formatting.parse(
-                            self.config.libraryformat, song, True)])]
-            except:
-                bd += [('f' + disc + track + song.file.lower(),
-                        [self.sonatapb, data,
-                         formatting.parse(self.config.libraryformat, song,
-                                          True)])]
+            title = song.title
+            if isinstance(title, str):
+                name = misc.lower_no_the(title)
+            else:
+                # No title (or several of them): sort by file name
+                name = song.file.lower()
+            bd.append((misc.get_sort_key('f' + disc + track + name),
+                       (self.sonatapb, data,
+                        formatting.parse(self.config.libraryformat, song,
+                                         True))))
         return bd
 
     def library_return_list_items(self, itemtype, genre=None, artist=None,
                                   album=None, year=None, ignore_case=True):
+        # Same as library_fetch_list_items, but the results are kept until
+        # the view caches are reset.
+        key = (itemtype, genre, artist, album, year, ignore_case)
+        results = self.lib_list_items_cache.get(key)
+        if results is None:
+            failed = self.lib_query_failed
+            self.lib_query_failed = False
+            results = self.library_fetch_list_items(itemtype, genre, artist,
+                                                    album, year, ignore_case)
+            if not self.lib_query_failed:
+                self.lib_list_items_cache[key] = results
+            self.lib_query_failed = self.lib_query_failed or failed
+        # Callers are free to modify the list they get
+        return list(results)
+
+    def library_fetch_list_items(self, itemtype, genre=None, artist=None,
+                                 album=None, year=None, ignore_case=True):
         # Returns all items of tag 'itemtype', in alphabetical order,
         # using mpd's 'list'. If searchtype is passed, use
         # a case insensitive search, via additional 'list'
         # queries, since using a single 'list' call will be
-        # case sensitive.
+        # case sensitive. The items are interned, since the same tag values
+        # end up in many SongRecords and cache keys.
         results = []
         searches = self.library_compose_list_count_searchlist(genre, artist,
                                                               album, year)
         if len(searches) > 0:
-            for s in searches:
-                # If we have untagged tags (''), use search instead
-                # of list because list will not return anything.
-                if '' in s:
-                    items = []
-                    songs, playtime, num_songs = \
-                            self.library_return_search_items(genre, artist,
-                                                             album, year)
-                    for song in songs:
-                        items.append(song.get(itemtype))
-                else:
-                    items = self.mpd.list(itemtype, *s)
-                for item in items:
-                    if len(item) > 0:
-                        results.append(item)
+            # If we have untagged tags (''), use search instead
+            # of list because list will not return anything.
+            list_searches = [s for s in searches if '' not in s]
+            items = []
+            if len(list_searches) < len(searches):
+                songs, _playtime, _num_songs = \
+                        self.library_return_search_items(genre, artist,
+                                                         album, year)
+                items.extend(song.get(itemtype) for song in songs)
+            list_results = self.mpd.command_list(
+                'list', [(itemtype,) + s for s in list_searches])
+            if list_results is None:
+                self.lib_query_failed = True
+                list_results = []
+            for list_items in list_results:
+                items.extend(list_items)
+        elif genre is None and artist is None and album is None and \
+             year is None:
+            items = self.mpd.list(itemtype)
         else:
-            if genre is None and artist is None and album is None and year \
-               is None:
-                for item in self.mpd.list(itemtype):
-                    if len(item) > 0:
-                        results.append(item)
+            items = []
+        for item in items:
+            if item:
+                results.append(sys.intern(item))
         if ignore_case:
-            results = misc.remove_list_duplicates(results, case=False)
-        results.sort(key=locale.strxfrm)
+            # Keep the first of the items only differing by their case
+            unique = {}
+            for item in results:
+                unique.setdefault(item.lower(), item)
+            results = list(unique.values())
+        results.sort(key=misc.get_sort_key)
         return results
 
     def library_return_count(self, genre=None, artist=None, album=None,
@@ -781,37 +1090,75 @@ class Library:
         # call 'count' for each of them. Using 'list' + 'count'
         # involves much less data to be transferred back and
         # forth than to use 'search' and count manually.
+        key = ('count', genre, artist, album, year)
+        if self.lib_query_memo is not None and key in self.lib_query_memo:
+            return self.lib_query_memo[key]
         searches = self.library_compose_list_count_searchlist(genre, artist,
                                                               album, year)
         playtime = 0
         num_songs = 0
-        for s in searches:
-            count = self.mpd.count(*s)
-            playtime += count.playtime
-            num_songs += count.songs
+        for count in self.library_count_searches(searches):
+            if count is not None:
+                playtime += count.playtime
+                num_songs += count.songs
 
+        if self.lib_query_memo is not None:
+            self.lib_query_memo[key] = (playtime, num_songs)
         return (playtime, num_songs)
 
+    def library_return_counts(self, queries):
+        # Same as library_return_count, for a list of queries given as
+        # keyword arguments. All the 'count' commands are sent to MPD at once
+        # instead of waiting for each result in turn.
+        searches = [self.library_compose_list_count_searchlist(**query)
+                    for query in queries]
+        counts = iter(self.library_count_searches(
+            [s for query_searches in searches for s in query_searches]))
+        results = []
+        for query_searches in searches:
+            playtime = 0
+            num_songs = 0
+            for _s in query_searches:
+                count = next(counts)
+                if count is not None:
+                    playtime += count.playtime
+                    num_songs += count.songs
+            results.append((playtime, num_songs))
+        return results
+
+    def library_count_searches(self, searches):
+        # Returns the result of 'count' for each search, sent all at once.
+        # If that fails, the searches are counted one by one: those which
+        # still fail count as None, and the view isn't cached.
+        counts = self.mpd.count_multiple(searches)
+        if counts is None:
+            counts = [self.mpd.count(*search) for search in searches]
+        if any(count is None for count in counts):
+            self.lib_query_failed = True
+        return counts
+
     def library_compose_list_count_searchlist_single(self, search, typename,
-                                                     cached_list, searchlist):
+                                                     searchlist):
         s = []
         skip_type = (typename == 'artist' and search == VARIOUS_ARTISTS)
         if search is not None and not skip_type:
             if search == self.NOTAG:
                 itemlist = [search, '']
             else:
-                itemlist = []
-                if cached_list is None:
-                    cached_list = self.library_return_list_items(typename,
-                                                             ignore_case=False)
+                variants = self.lib_list_variants.get(typename)
+                if variants is None:
+                    # Map the lowercased items to their case variants
+                    variants = {}
+                    for item in self.library_return_list_items(
+                        typename, ignore_case=False):
+                        variants.setdefault(item.lower(), []).append(item)
                     # This allows us to match untagged items
-                    cached_list.append('')
-                for item in cached_list:
-                    if str(item).lower() == str(search).lower():
-                        itemlist.append(item)
+                    variants.setdefault('', []).append('')
+                    self.lib_list_variants[typename] = variants
+                itemlist = variants.get(str(search).lower(), [])
             if len(itemlist) == 0:
                 # There should be no results!
-                return None, cached_list
+                return None
             for item in itemlist:
                 if len(searchlist) > 0:
                     for item2 in searchlist:
@@ -820,31 +1167,17 @@ class Library:
                     s.append((typename, item))
         else:
             s = searchlist
-        return s, cached_list
+        return s
 
     def library_compose_list_count_searchlist(self, genre=None, artist=None,
                                               album=None, year=None):
         s = []
-        s, self.lib_list_genres = \
-                self.library_compose_list_count_searchlist_single(
-                    genre, 'genre', self.lib_list_genres, s)
-        if s is None:
-            return []
-        s, self.lib_list_artists = \
-                self.library_compose_list_count_searchlist_single(
-                    artist, 'artist', self.lib_list_artists, s)
-        if s is None:
-            return []
-        s, self.lib_list_albums = \
-                self.library_compose_list_count_searchlist_single(
-                    album, 'album', self.lib_list_albums, s)
-        if s is None:
-            return []
-        s, self.lib_list_years = \
-                self.library_compose_list_count_searchlist_single(
-                    year, 'date', self.lib_list_years, s)
-        if s is None:
-            return []
+        for search, typename in ((genre, 'genre'), (artist, 'artist'),
+                                 (album, 'album'), (year, 'date')):
+            s = self.library_compose_list_count_searchlist_single(
+                search, typename, s)
+            if s is None:
+                return []
         return s
 
     def library_compose_search_searchlist_single(self, search, typename,
@@ -879,67 +1212,42 @@ class Library:
                                     year=None):
         # Returns all mpd items, using mpd's 'search', along with
         # playtime and num_songs.
-        searches = self.library_compose_search_searchlist(genre, artist, album,
-                                                          year)
-        for s in searches:
-            args_tuple = tuple(map(str, s))
-            playtime = 0
-            num_songs = 0
-            results = []
-            strip_type = None
-
-            if len(args_tuple) == 0:
-                return None, 0, 0
-
-            items = self.mpd.search(*args_tuple)
-            if items is not None:
-                for item in items:
-                    if strip_type is None or (strip_type is not None and not \
-                                              strip_type in item.keys()):
-                        match = True
-                        pos = 0
-                        # Ensure that if, e.g., "foo" is searched,
-                        # "foobar" isn't returned too
-                        for arg in args_tuple[::2]:
-                            if arg in item and \
-                               str(item.get(arg, '')).upper() != \
-                               str(args_tuple[pos + 1]).upper():
-                                match = False
-                                break
-                            pos += 2
-                        if match:
-                            results.append(item)
-                            num_songs += 1
-                            playtime += item.time
+        key = ('search', genre, artist, album, year)
+        if self.lib_query_memo is not None and key in self.lib_query_memo:
+            return self.lib_query_memo[key]
+        searches = [tuple(map(str, s)) for s in
+                    self.library_compose_search_searchlist(genre, artist,
+                                                           album, year)]
+        playtime = 0
+        num_songs = 0
+        results = []
+        found = self.mpd.command_list('search', searches)
+        if found is None:
+            self.lib_query_failed = True
+            found = []
+        for args_tuple, items in zip(searches, found):
+            for item in items:
+                match = True
+                pos = 0
+                # Ensure that if, e.g., "foo" is searched,
+                # "foobar" isn't returned too
+                for arg in args_tuple[::2]:
+                    if arg in item and \
+                       str(item.get(arg, '')).upper() != \
+                       str(args_tuple[pos + 1]).upper():
+                        match = False
+                        break
+                    pos += 2
+                if match:
+                    results.append(item)
+                    num_songs += 1
+                    playtime += item.time
+        if self.lib_query_memo is not None:
+            self.lib_query_memo[key] = (results, int(playtime), num_songs)
         return (results, int(playtime), num_songs)
 
-    def add_display_info(self, num_songs, playtime):
-        seconds = int(playtime)
-        hours   = seconds // 3600
-        seconds -= 3600 * hours
-        minutes = seconds // 60
-        seconds -= 60 * minutes
-        songs_text = ngettext('{count} song', '{count} songs',
-                              num_songs).format(count=num_songs)
-        seconds_text = ngettext('{count} second', '{count} seconds',
-                                seconds).format(count=seconds)
-        minutes_text = ngettext('{count} minute', '{count} minutes',
-                                minutes).format(count=minutes)
-        hours_text = ngettext('{count} hour', '{count} hours',
-                              hours).format(count=hours)
-        time_parts = [songs_text]
-        if hours > 0:
-            time_parts.extend([hours_text, minutes_text])
-        elif minutes > 0:
-            time_parts.extend([minutes_text, seconds_text])
-        else:
-            time_parts.extend([seconds_text])
-        display_markup = "\n<small><span weight='light'>{}</span></small>"
-        display_text = ', '.join(time_parts)
-        return display_markup.format(display_text)
-
-    def library_retain_selection(self, prev_selection, prev_selection_root,
-                                 prev_selection_parent):
+    def library_retain_selection(self, bd, prev_selection,
+                                 prev_selection_root, prev_selection_parent):
         # Unselect everything:
         if len(self.librarydata) > 0:
             first = Gtk.TreePath.new_first()
@@ -947,11 +1255,16 @@ class Library:
             to.append_index(len(self.librarydata) - 1)
             self.library_selection.unselect_range(first, to)
         # Now attempt to retain the selection from before the update:
-        for value in prev_selection:
-            for row in self.librarydata:
-                if value == row[1]:
-                    self.library_selection.select_path(row.path)
-                    break
+        if prev_selection:
+            # The model holds the rows of bd, in the same order: find the
+            # rows there rather than reading them back from the model
+            positions = {}
+            for position, (_sort, row) in enumerate(bd):
+                positions.setdefault(row[1], position)
+            for value in prev_selection:
+                position = positions.get(value)
+                if position is not None:
+                    self.library_selection.select_path((position,))
         if prev_selection_root:
             self.library_selection.select_path((0,))
         if prev_selection_parent:
@@ -1066,10 +1379,10 @@ class Library:
     def library_get_parent(self):
         wd = self.config.wd
         if self.config.lib_view == consts.VIEW_ALBUM:
-            value = SongRecord(path="/")
+            value = ROOT
         elif self.config.lib_view == consts.VIEW_ARTIST:
             if wd.album is None:
-                value = SongRecord(path="/")
+                value = ROOT
             else:
                 value = SongRecord(artist = wd.artist)
         elif self.config.lib_view == consts.VIEW_GENRE:
@@ -1079,7 +1392,7 @@ class Library:
             elif wd.artist is not None:
                 value = SongRecord(genre=wd.genre)
             else:
-                value = SongRecord(path="/")
+                value = ROOT
         else:
             newvalue = '/'.join(wd.path.split('/')[:-1]) or '/'
             value = SongRecord(path=newvalue)
@@ -1108,7 +1421,11 @@ class Library:
         # instead of individual songs in order to reduce the number of
         # mpd calls we need to make. We won't want this behavior in some
         # instances, like when we want all end files for editing tags
-        items = []
+        # The files of each row, in order
+        parts = []
+        # The directories to list recursively, and where their files go
+        directories = []
+        directory_parts = []
         if selected_only:
             model, rows = self.library_selection.get_selected_rows()
         else:
@@ -1124,35 +1441,37 @@ class Library:
                    data.year is None and data.genre is None:
                     if pb == self.sonatapb:
                         # File
-                        items.append(data.path)
+                        parts.append([data.path])
                     else:
                         # Directory
                         if not return_root:
-                            items += self.library_get_path_files_recursive(
-                                data.path)
+                            part = []
+                            parts.append(part)
+                            directories.append((data.path,))
+                            directory_parts.append(part)
                         else:
-                            items.append(data.path)
+                            parts.append([data.path])
                 else:
                     results, _playtime, _num_songs = \
                             self.library_return_search_items(
                                 genre=data.genre, artist=data.artist, album=data.album,
                                 year=data.year)
-                    for item in results:
-                        items.append(item.file)
-        # Make sure we don't have any EXACT duplicates:
-        items = misc.remove_list_duplicates(items, case=True)
+                    parts.append([item.file for item in results])
+        # List all the directories in a single command list
+        listings = self.mpd.command_list('listall', directories) or []
+        for part, listing in zip(directory_parts, listings):
+            part.extend(item['file'] for item in listing if 'file' in item)
+        # Make sure we don't have any EXACT duplicates, keeping the order
+        # (dicts don't keep it before Python 3.7):
+        items = []
+        seen = set()
+        for part in parts:
+            for item in part:
+                if item not in seen:
+                    seen.add(item)
+                    items.append(item)
         return items
 
-    def library_get_path_files_recursive(self, path):
-        results = []
-        for item in self.mpd.lsinfo(path):
-            if 'directory' in item:
-                results = results + self.library_get_path_files_recursive(
-                    item['directory'])
-            elif 'file' in item:
-                results.append(item['file'])
-        return results
-
     def on_library_search_combo_change(self, _combo=None):
         self.config.last_search_num = self.searchcombo.get_active()
         if not self.search_visible():
@@ -1176,13 +1495,21 @@ class Library:
             self.prevlibtodo_base = "__"
             self.prevlibtodo_base_results = []
             # extra thread for background search work,
-            # synchronized with a condition and its internal mutex
-            self.libfilterbox_cond = threading.Condition()
-            self.libfilterbox_cmd_buf = self.searchtext.get_text()
-            qsearch_thread = threading.Thread(target=self.libsearchfilter_loop)
-            qsearch_thread.name = "LibraryFilter"
-            qsearch_thread.daemon = True
-            qsearch_thread.start()
+            # synchronized with a condition and its internal mutex. It is
+            # started the first time, and waits for the next search after
+            # being stopped.
+            start_thread = self.libfilterbox_cond is None
+            if start_thread:
+                self.libfilterbox_cond = threading.Condition()
+            with self.libfilterbox_cond:
+                self.libfilterbox_cmd_buf = self.searchtext.get_text()
+                self.libfilterbox_cond.notify()
+            if start_thread:
+                qsearch_thread = threading.Thread(
+                    target=self.libsearchfilter_loop)
+                qsearch_thread.name = "LibraryFilter"
+                qsearch_thread.daemon = True
+                qsearch_thread.start()
         elif self.search_visible():
             ui.hide(self.searchbutton)
             self.searchtext.handler_block(self.libfilter_changed_handler)
@@ -1198,66 +1525,155 @@ class Library:
     def libsearchfilter_feed_loop(self, editable):
         if not self.search_visible():
             self.libsearchfilter_toggle(None)
-        # Lets only trigger the searchfilter_loop if 200ms pass
-        # without a change in Gtk.Entry
-        try:
-            GLib.source_remove(self.libfilterbox_source)
-        except:
-            pass
-        self.libfilterbox_source = GLib.timeout_add(
-            300, self.libsearchfilter_start_loop, editable)
+        # Lets only trigger the searchfilter_loop if 300ms pass
+        # without a change in Gtk.Entry. Each keystroke only pushes the
+        # deadline back; a single timeout is kept pending and re-arms itself
+        # until the deadline is reached.
+        self.libfilterbox_deadline = GLib.get_monotonic_time() + 300000
+        if self.libfilterbox_source is None:
+            self.libfilterbox_source = GLib.timeout_add(
+                300, self.libsearchfilter_deadline_reached, editable)
+
+    def libsearchfilter_deadline_reached(self, editable):
+        remaining = self.libfilterbox_deadline - GLib.get_monotonic_time()
+        if remaining > 0:
+            self.libfilterbox_source = GLib.timeout_add(
+                remaining // 1000 + 1, self.libsearchfilter_deadline_reached,
+                editable)
+            return False
+        self.libfilterbox_source = None
+        self.libsearchfilter_start_loop(editable)
+        return False
 
     def libsearchfilter_start_loop(self, editable):
-        self.libfilterbox_cond.acquire()
-        self.libfilterbox_cmd_buf = editable.get_text()
-        self.libfilterbox_cond.notifyAll()
-        self.libfilterbox_cond.release()
+        with self.libfilterbox_cond:
+            self.libfilterbox_cmd_buf = editable.get_text()
+            # There's a single filter thread waiting on the condition
+            self.libfilterbox_cond.notify()
 
     def libsearchfilter_stop_loop(self):
-        self.libfilterbox_cond.acquire()
-        self.libfilterbox_cmd_buf = '$$$QUIT###'
-        self.libfilterbox_cond.notifyAll()
-        self.libfilterbox_cond.release()
+        with self.libfilterbox_cond:
+            self.libfilterbox_cmd_buf = '$$$QUIT###'
+            self.libfilterbox_cond.notify()
+
+    def libsearchfilter_reset_connection(self):
+        # Called when disconnected from mpd (or switching to another
+        # server): the filter thread's connection and the base results it
+        # got are from the previous server.
+        self.prevlibtodo_base = "__"
+        self.prevlibtodo_base_results = []
+        if self.libfilterbox_cond is None:
+            return
+        with self.libfilterbox_cond:
+            self.libfilterbox_reset = True
+            self.libfilterbox_cond.notify()
 
     def libsearchfilter_loop(self):
+        cond = self.libfilterbox_cond
+        has_command = lambda: (self.libfilterbox_cmd_buf != '$$$DONE###' or
+                               self.libfilterbox_reset)
+        # The base searches are sent from this thread, so that the interface
+        # doesn't wait for mpd: this needs a connection of our own.
+        search_mpd = None
         while True:
             # copy the last command or pattern safely
-            self.libfilterbox_cond.acquire()
-            try:
-                while(self.libfilterbox_cmd_buf == '$$$DONE###'):
-                    self.libfilterbox_cond.wait()
-                todo = self.libfilterbox_cmd_buf
-                self.libfilterbox_cond.release()
-            except:
+            with cond:
+                cond.wait_for(has_command)
                 todo = self.libfilterbox_cmd_buf
+                reset = self.libfilterbox_reset
+                self.libfilterbox_reset = False
+            if reset and search_mpd is not None:
+                search_mpd.disconnect()
+                search_mpd = None
+            if todo == '$$$DONE###':
+                # Only woken up to drop the connection
+                continue
             searchby = self.search_terms_mpd[self.config.last_search_num]
             if self.prevlibtodo != todo:
                 if todo == '$$$QUIT###':
+                    # Don't keep an idle connection until the next search
+                    if search_mpd is not None:
+                        search_mpd.disconnect()
+                        search_mpd = None
                     GLib.idle_add(ui.reset_entry_marking, self.searchtext)
-                    return
+                    with cond:
+                        if self.libfilterbox_cmd_buf == todo:
+                            self.libfilterbox_cmd_buf = '$$$DONE###'
+                    # The next search starts afresh, see
+                    # libsearchfilter_toggle
+                    continue
                 elif len(todo) > 1:
+                    new_base = not self.prevlibtodo_base in todo
+                    base_results = None
+                    if new_base:
+                        # Do library search based on first two letters:
+                        self.prevlibtodo_base = todo[:2]
+                        for _attempt in range(2):
+                            if search_mpd is None:
+                                search_mpd = self.mpd.new_connection()
+                            if search_mpd is None:
+                                break
+                            base_results = self.libsearchfilter_base_results(
+                                search_mpd, searchby, todo[:2])
+                            if base_results is not None:
+                                break
+                            # mpd closes connections left idle for too long:
+                            # try again once with a new one, then let the
+                            # main thread search by itself.
+                            search_mpd.disconnect()
+                            search_mpd = None
                     GLib.idle_add(self.libsearchfilter_do_search, searchby,
-                                  todo)
+                                  todo, new_base, base_results)
                 elif len(todo) == 0:
                     GLib.idle_add(ui.reset_entry_marking, self.searchtext)
                     self.libsearchfilter_toggle(False)
                 else:
                     GLib.idle_add(ui.reset_entry_marking, self.searchtext)
-            self.libfilterbox_cond.acquire()
-            self.libfilterbox_cmd_buf = '$$$DONE###'
-            try:
-                self.libfilterbox_cond.release()
-            except Exception as e:
-                # XXX add logger here in the future!
-                raise e
+            with cond:
+                # Don't swallow a command fed while we were busy
+                if self.libfilterbox_cmd_buf == todo:
+                    self.libfilterbox_cmd_buf = '$$$DONE###'
             self.prevlibtodo = todo
 
-    def libsearchfilter_do_search(self, searchby, todo):
-        if not self.prevlibtodo_base in todo:
-            # Do library search based on first two letters:
-            self.prevlibtodo_base = todo[:2]
-            self.prevlibtodo_base_results = self.mpd.search(searchby,
-                                                             self.prevlibtodo_base)
+    def libsearchfilter_base_results(self, mpd, searchby, base):
+        # Returns None if the search failed
+        results = mpd.search(searchby, base)
+        if results is None:
+            return None
+        # Build and sort the rows once for all the subsequent searches
+        # starting with the same letters: filtering keeps them in order.
+        base_results = []
+        for item in results:
+            if 'file' in item:
+                display = formatting.parse(self.config.libraryformat, item,
+                                           True)
+                base_results.append((misc.get_sort_key(display), item,
+                                     (self.sonatapb,
+                                      SongRecord(path=item['file']),
+                                      display)))
+        base_results.sort(key=operator.itemgetter(0))
+        # Keep the lowercased text searched in each row along with it,
+        # so that it's built once for all the subsequent searches
+        if searchby != 'any':
+            return [(item.get(searchby, '').lower(), row)
+                    for _sort, item, row in base_results]
+        else:
+            return [(" ".join(item.values()).lower(), row)
+                    for _sort, item, row in base_results]
+
+    def libsearchfilter_do_search(self, searchby, todo, new_base,
+                                  base_results):
+        if new_base:
+            if base_results is None:
+                # The filter thread couldn't connect to mpd by itself
+                base_results = self.libsearchfilter_base_results(
+                    self.mpd, searchby, todo[:2])
+            if base_results is None:
+                # Don't keep a failed search as the results of this base,
+                # search again on the next change
+                self.prevlibtodo_base = "__"
+                base_results = []
+            self.prevlibtodo_base_results = base_results
             subsearch = False
         else:
             subsearch = True
@@ -1269,43 +1685,22 @@ class Library:
         # Note that the searching is not order specific. That is, "foo bar"
         # will match on "fools bar" and "barstool foo".
 
-        todos = todo.split(" ")
-        regexps = []
-        for i in range(len(todos)):
-            todos[i] = misc.escape_html(todos[i])
-            todos[i] = re.escape(todos[i])
-            todos[i] = '.*' + todos[i].lower()
-            regexps.append(re.compile(todos[i]))
-        matches = []
-        if searchby != 'any':
-            for row in self.prevlibtodo_base_results:
-                is_match = True
-                for regexp in regexps:
-                    if not regexp.match(row.get(searchby, '').lower()):
-                        is_match = False
-                        break
-                if is_match:
-                    matches.append(row)
-        else:
-            for row in self.prevlibtodo_base_results:
-                allstr = " ".join(row.values())
-                is_match = True
-                for regexp in regexps:
-                    if not regexp.match(str(allstr).lower()):
-                        is_match = False
-                        break
-                if is_match:
-                    matches.append(row)
+        # The words are searched literally, so plain substring tests are
+        # enough (and much cheaper than regular expressions)
+        needles = [misc.escape_html(word).lower() for word in todo.split()]
+        # Longer words are less likely to match: try them first so that
+        # all() gives up on most rows after a single test
+        needles.sort(key=len, reverse=True)
+        matches = [row for haystack, row in self.prevlibtodo_base_results
+                   if all(needle in haystack for needle in needles)]
         if subsearch and len(matches) == len(self.librarydata):
             # nothing changed..
             return
+        self.library_populate_cancel()
         self.library.freeze_child_notify()
         currlen = len(self.librarydata)
-        bd = [(self.sonatapb,
-               SongRecord(path=item['file']),
-               formatting.parse(self.config.libraryformat, item, True))
-              for item in matches if 'file' in item]
-        bd.sort(key=lambda key: locale.strxfrm(key[2]))
+        bd = matches
+        columns = list(range(self.librarydata.get_n_columns()))
         for i, item in enumerate(bd):
             if i < currlen:
                 j = self.librarydata.get_iter((i, ))
@@ -1313,7 +1708,7 @@ class Library:
                     if item[index] != self.librarydata.get_value(j, index):
                         self.librarydata.set_value(j, index, item[index])
             else:
-                self.librarydata.append(item)
+                self.librarydata.insert_with_valuesv(-1, columns, item)
         # Remove excess items...
         newlen = len(bd)
         if newlen == 0:
@@ -1323,12 +1718,17 @@ class Library:
                 j = self.librarydata.get_iter((currlen - 1 - i,))
                 self.librarydata.remove(j)
         self.library.thaw_child_notify()
-        if len(matches) == 0:
-            GLib.idle_add(ui.set_entry_invalid, self.searchtext)
+        GLib.idle_add(self.libsearchfilter_shown, len(matches) > 0)
+
+    def libsearchfilter_shown(self, found):
+        # Once the filtered rows are in, mark the entry and move the cursor
+        # to the first match in a single main loop iteration
+        if found:
+            self.library.set_cursor(Gtk.TreePath.new_first(), None, False)
+            ui.reset_entry_marking(self.searchtext)
         else:
-            GLib.idle_add(self.library.set_cursor, Gtk.TreePath.new_first(),
-                          None, False)
-            GLib.idle_add(ui.reset_entry_marking, self.searchtext)
+            ui.set_entry_invalid(self.searchtext)
+        return False
 
     def libsearchfilter_key_pressed(self, widget, event):
         self.filter_key_pressed(widget, event, self.library)
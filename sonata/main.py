@@ -748,8 +748,7 @@ class Base:
         self.streamsdata = self.streams.get_model()
 
         # Initialize library data and widget
-        self.librarydata = self.library.get_model()
-        self.artwork.library_artwork_init(self.librarydata,
+        self.artwork.library_artwork_init(self.library.get_model(),
                                           consts.LIB_COVER_SIZE)
 
         icon = self.window.render_icon('sonata', Gtk.IconSize.DIALOG)
@@ -1343,7 +1342,10 @@ class Base:
             self.playing_song_change()
             self.update_statusbar()
             if not self.conn:
-                self.librarydata.clear()
+                # Don't let the pending rows fill the library again
+                self.library.library_populate_cancel()
+                self.library.libsearchfilter_reset_connection()
+                self.library.get_model().clear()
                 self.playlistsdata.clear()
                 self.streamsdata.clear()
             return
@@ -1765,6 +1767,7 @@ class Base:
                 return True
         self.settings_save()
         self.artwork.artwork_save_cache()
+        self.library.view_caches_save()
         if self.config.as_enabled:
             self.scrobbler.save_cache()
         if self.conn and self.config.stop_on_exit:
@@ -1938,7 +1941,7 @@ class Base:
         if self.conn:
             if self.library.search_visible():
                 self.library.on_search_end(None)
-            self.mpd.update('/') # XXX we should pass a list here!
+            self.mpd.update('/', self.status) # XXX we should pass a list here!
             self.mpd_update_queued = True
 
     def on_updatedb_shortcut(self, _action):
@@ -1956,7 +1959,7 @@ class Base:
             filenames = self.library.get_path_child_filenames(True,
                                                               selected_only)
             if len(filenames) > 0:
-                self.mpd.update(filenames)
+                self.mpd.update(filenames, self.status)
                 self.mpd_update_queued = True
 
     def on_image_activate(self, widget, event):
@@ -3001,7 +3004,7 @@ class Base:
                 self.UIManager.get_widget('/mainmenu/' + menu + 'menu/').hide()
 
         elif self.current_tab == self.TAB_LIBRARY:
-            if len(self.librarydata) > 0:
+            if len(self.library.get_model()) > 0:
                 path_update = '/mainmenu/updatemenu/updateselectedmenu/'
                 if self.library_selection.count_selected_rows() > 0:
                     for menu in ['add', 'replace', 'playafter', 'tag', 'pl']:
@@ -3103,7 +3106,7 @@ class Base:
         self.config.tags_use_mpdpath = use_mpdpath
 
     def tags_mpd_update(self, tag_paths):
-        self.mpd.update(list(tag_paths))
+        self.mpd.update(list(tag_paths), self.status)
         self.mpd_update_queued = True
 
     def on_about(self, _action):
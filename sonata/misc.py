@@ -1,4 +1,5 @@
 
+import functools
 import os
 import subprocess
 import re
@@ -29,6 +30,7 @@ def convert_time_raw(seconds):
     seconds -= 60 * minutes
     return hours, minutes, seconds
 
+@functools.lru_cache(maxsize=65536)
 def escape_html(s):
     if not s: # None or ""
         return ""
@@ -93,8 +95,9 @@ def link_markup(s, enclose_in_parentheses, small, linkcolor):
 def iunique(iterable, key=id):
     seen = set()
     for i in iterable:
-        if key(i) not in seen:
-            seen.add(key(i))
+        k = key(i)
+        if k not in seen:
+            seen.add(k)
             yield i
 
 
@@ -113,10 +116,48 @@ def remove_list_duplicates(inputlist, case=True):
 the_re = re.compile('^the ')
 
 
+@functools.lru_cache(maxsize=65536)
 def lower_no_the(s):
-    s = the_re.sub('', s.lower())
-    s = str(s)
-    return s
+    return the_re.sub('', s.lower())
+
+
+_sort_key_func = None
+_sort_key_backend = None
+
+
+def _init_sort_key():
+    global _sort_key_func, _sort_key_backend
+    try:
+        import icu
+        collator = icu.Collator.createInstance(icu.Locale.getDefault())
+        _sort_key_func = collator.getSortKey
+        _sort_key_backend = 'icu-%s' % icu.ICU_VERSION
+    except ImportError:
+        _sort_key_func = locale.strxfrm
+        _sort_key_backend = 'strxfrm'
+
+
+def get_sort_key_backend():
+    """Return the name of the library building the keys of get_sort_key().
+
+    Keys built by different backends (or ICU versions) don't compare."""
+    if _sort_key_func is None:
+        _init_sort_key()
+    return _sort_key_backend
+
+
+@functools.lru_cache(maxsize=16384)
+def get_sort_key(s):
+    """Return a key to sort s according to the current locale.
+
+    PyICU is used when available since its collation keys are compact and
+    cheaper to build than locale.strxfrm's; otherwise fall back to the C
+    library. The keys are memoized since the same names are sorted again
+    each time the library is browsed; call get_sort_key.cache_clear() if
+    the collation locale changes."""
+    if _sort_key_func is None:
+        _init_sort_key()
+    return _sort_key_func(s)
 
 
 def create_dir(dirname):
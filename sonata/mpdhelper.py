@@ -1,14 +1,11 @@
 
 import functools
 import logging
-import os
 import socket
+import sys
 
-from gi.repository import GObject
 import mpd
 
-from sonata.misc import remove_list_duplicates
-
 
 class MPDClient:
     def __init__(self, client=None):
@@ -19,6 +16,9 @@ class MPDClient:
         else:
             client.use_unicode = True
         self._client = client
+        self._address = None
+        self._password = None
+        self._version = None
         self.logger = logging.getLogger(__name__)
 
     def __getattr__(self, attr):
@@ -36,38 +36,122 @@ class MPDClient:
         try:
             retval = cmd(*args)
         except (socket.error, mpd.MPDError) as e:
-            if cmd_name in ['lsinfo', 'list']:
+            error_result = ERROR_RESULTS.get(cmd_name)
+            if error_result is not None:
                 # return sane values, which could be used afterwards
-                return []
-            elif cmd_name == 'status':
-                return {}
+                return error_result()
             else:
                 self.logger.error("%s", e)
                 return None
 
-        if cmd_name in ['songinfo', 'currentsong']:
-            return MPDSong(retval)
-        elif cmd_name in ['plchanges', 'search']:
-            return [MPDSong(s) for s in retval]
-        elif cmd_name in ['count']:
-            return MPDCount(retval)
-        else:
+        return self._convert(cmd_name, retval)
+
+    def _convert(self, cmd_name, retval):
+        converter = CONVERTERS.get(cmd_name)
+        if converter is None:
             return retval
+        return converter(retval)
+
+    def connect(self, host, port):
+        # Remember where we are connected, for new_connection()
+        self._address = (host, port)
+        self._password = None
+        self._version = None
+        return self._call(self._client.connect, 'connect', host, port)
+
+    def password(self, password):
+        self._password = password
+        return self._call(self._client.password, 'password', password)
+
+    def new_connection(self):
+        """Open another connection to the MPD server we are connected to.
+
+        python-mpd's clients can't be shared between threads, so threads
+        talking to MPD on their own need their own connection.
+        Returns None if the connection failed."""
+        if self._address is None:
+            return None
+        client = MPDClient()
+        try:
+            client._client.connect(*self._address)
+            if self._password:
+                client._client.password(self._password)
+        except (socket.error, mpd.MPDError) as e:
+            self.logger.error("%s", e)
+            return None
+        return client
 
     @property
     def version(self):
-        return tuple(int(part) for part in self._client.mpd_version.split("."))
-
-    def update(self, paths):
-        if mpd_is_updating(self.status()):
+        # Parsed once for each connection
+        if self._version is None:
+            self._version = tuple(int(part) for part in
+                                  self._client.mpd_version.split("."))
+        return self._version
+
+    def command_list(self, cmd_name, args_list):
+        """Run a command once for each arguments tuple in a single command
+        list, which avoids a round-trip to MPD for each of them.
+
+        Returns the list of the results, or None if the command list failed.
+        MPD stops at the first command which fails: a single bad set of
+        arguments fails the whole list, and callers have to fall back on
+        something else for all of them.
+        """
+        if not args_list:
+            return []
+        cmd = getattr(self._client, cmd_name)
+        try:
+            self._client.command_list_ok_begin()
+            for args in args_list:
+                cmd(*args)
+            results = self._client.command_list_end()
+        except (socket.error, mpd.MPDError) as e:
+            self.logger.error("%s", e)
+            self._command_list_abort()
+            return None
+        return [self._convert(cmd_name, r) for r in results]
+
+    def _command_list_abort(self):
+        # Don't leave python-mpd in the middle of a command list after an
+        # error, or all the following commands would fail.
+        try:
+            self._client.command_list_end()
+        except mpd.CommandListError:
+            # Not in a command list anymore
+            pass
+        except (socket.error, mpd.MPDError) as e:
+            # The connection is in an unknown state: start over
+            self.logger.error("%s", e)
+            try:
+                self._client.disconnect()
+            except (socket.error, mpd.MPDError):
+                pass
+
+    def count_multiple(self, searches):
+        """Run a 'count' command for each search in a single command list.
+
+        Returns None if any of them fails."""
+        return self.command_list('count', searches)
+
+    def update(self, paths, status=None):
+        # status can be passed by callers which already know it, to spare a
+        # round-trip to MPD
+        if status is None:
+            status = self.status()
+        if mpd_is_updating(status):
             return
 
         # Updating paths seems to be faster than updating files for
-        # some reason:
+        # some reason. MPD's paths always use '/', and an empty path updates
+        # the whole database, like '/':
         dirs = []
+        seen = set()
         for path in paths:
-            dirs.append(os.path.dirname(path))
-        dirs = remove_list_duplicates(dirs, True)
+            directory = path.rpartition('/')[0]
+            if directory not in seen:
+                seen.add(directory)
+                dirs.append(directory)
 
         self._client.command_list_ok_begin()
         for directory in dirs:
@@ -85,25 +169,33 @@ class MPDCount:
         self.songs = int(m['songs'])
 
 
-# Inherits from GObject for to be stored in Gtk's ListStore
-class MPDSong(GObject.GObject):
+class MPDSong:
     """Provide information about a song in a convenient format"""
 
+    __slots__ = ['_mapping']
+
     def __init__(self, mapping):
-        self._mapping = {}
-        for key, value in mapping.items():
-            # Some attributes may be present several times, which is translated
-            # into a list of values by python-mpd. We keep only the first one,
-            # since Sonata doesn't really support multi-valued attributes at the
-            # moment.
-            if isinstance(value, list):
-                value = value[0]
-            self._mapping[key] = value
-        super().__init__()
+        self._mapping = song_mapping(mapping)
+
+    @classmethod
+    def from_many(cls, mappings):
+        """Build a song for each mapping, like the results of 'search'.
+
+        This is the same as calling MPDSong() on each of them, without
+        going through __init__ for every song."""
+        new = object.__new__
+        songs = []
+        for mapping in mappings:
+            song = new(cls)
+            song._mapping = song_mapping(mapping)
+            songs.append(song)
+        return songs
 
     def __eq__(self, other):
-        return isinstance(other, self.__class__) and \
-                self._mapping == other._mapping
+        # The same song is often compared with itself, like when the
+        # current playlist is redrawn
+        return self is other or (isinstance(other, self.__class__) and
+                                 self._mapping == other._mapping)
 
     def __ne__(self, other):
         return not (self == other)
@@ -156,9 +248,41 @@ class MPDSong(GObject.GObject):
     def file(self):
         return self._mapping.get('file', '') # XXX should be always here?
 
+# How the results of some commands are converted
+CONVERTERS = {
+    'songinfo': MPDSong,
+    'currentsong': MPDSong,
+    'plchanges': MPDSong.from_many,
+    'search': MPDSong.from_many,
+    'count': MPDCount,
+}
+
+# What some commands return when they fail
+ERROR_RESULTS = {
+    'lsinfo': list,
+    'list': list,
+    'listall': list,
+    'status': dict,
+}
+
+def song_mapping(mapping):
+    # Some attributes may be present several times, which is translated
+    # into a list of values by python-mpd. We keep only the first one,
+    # since Sonata doesn't really support multi-valued attributes at the
+    # moment.
+    # The keys are interned: all the songs then share the same key strings,
+    # and looking them up with the literals used in the code only compares
+    # pointers.
+    return {sys.intern(key): value[0] if type(value) is list else value
+            for key, value in mapping.items()}
+
+NUMERIC_SEPARATORS = str.maketrans(',/', '  ')
+
 def cleanup_numeric(value):
+    if type(value) is int:
+        return value
     # track and disc can be oddly formatted (eg, '4/10')
-    value = str(value).replace(',', ' ').replace('/', ' ').split()[0]
+    value = str(value).translate(NUMERIC_SEPARATORS).lstrip().partition(' ')[0]
     return int(value) if value.isdigit() else 0
 
 # XXX to be move when we can handle status change in the main interface
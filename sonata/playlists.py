@@ -201,8 +201,8 @@ class Playlists:
                 if 'playlist' in item:
                     playlistinfo.append(misc.escape_html(item['playlist']))
 
-            # Remove case sensitivity
-            playlistinfo.sort(key=lambda x: x.lower())
+            # Remove case sensitivity, sort like the library
+            playlistinfo.sort(key=lambda name: misc.get_sort_key(name.lower()))
             for item in playlistinfo:
                 self.playlistsdata.append([Gtk.STOCK_DIRECTORY, item])
 
@@ -30,23 +30,33 @@ class SongRecord:
         """Return a nicely formatted representation string"""
         return "<SongRecord album='%s', artist='%s', genre='%s', year='%s', path='%s'>" % (
             self.album, self.artist, self.genre, self.year, self.path)
+    def artwork_key(self):
+        """Return the key of the record's album in the artwork cache: a plain
+        tuple, cheaper to build and hash than another record"""
+        return (self.artist, self.album, self.path)
     def __key(self):
         return (self.album, self.artist, self.genre, self.year, self.path)
+    @staticmethod
+    def __other_key(other):
+        """Compare directly against another record's key, rather than going
+        through the reflected comparison of a tuple with a SongRecord"""
+        if isinstance(other, SongRecord):
+            return other.__key()
+        return other
     def __iter__(self):
         """Make the classed iterable. useful for unpacking variables"""
-        for i in (self.album, self.artist, self.genre, self.year, self.path):
-            yield i
+        return iter(self.__key())
     def __hash__(self):
         return hash(self.__key())
     def __lt__(self, other):
-        return self.__key() <  other
+        return self.__key() < self.__other_key(other)
     def __le__(self, other):
-        return self.__key() <=  other
+        return self.__key() <= self.__other_key(other)
     def __eq__(self, other):
-        return self.__key() == other
+        return self.__key() == self.__other_key(other)
     def __ne__(self, other):
-        return self.__key() != other
+        return self.__key() != self.__other_key(other)
     def __gt__(self, other):
-        return self.__key() > other
+        return self.__key() > self.__other_key(other)
     def __ge__(self, other):
-        return self.__key() >= other
+        return self.__key() >= self.__other_key(other)
@@ -124,7 +124,8 @@ class Streams:
                 'uri' : misc.escape_html(uri)}
                 for name, uri in zip(self.config.stream_names,
                              self.config.stream_uris)]
-        streamsinfo.sort(key=lambda x: x["name"].lower()) # Remove case sensitivity
+        # Remove case sensitivity, sort like the library
+        streamsinfo.sort(key=lambda x: misc.get_sort_key(x["name"].lower()))
         for item in streamsinfo:
             self.streamsdata.append([Gtk.STOCK_NETWORK, item["name"], item["uri"]])
 
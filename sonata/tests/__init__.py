@@ -6,6 +6,9 @@ import gettext
 import os
 import sys
 import operator
+from unittest import mock
+
+import mpd
 
 # This currently needed, because gettext is used in some module, i want to test
 try:
@@ -14,8 +17,8 @@ except:
     gettext.install('sonata', '/usr/share/locale')
     gettext.textdomain('sonata')
 
-from sonata import misc, song, library
-from sonata.mpdhelper import MPDSong
+from sonata import misc, song, library, formatting, consts
+from sonata.mpdhelper import MPDClient, MPDSong, cleanup_numeric
 
 DOCTEST_FLAGS = (
     doctest.ELLIPSIS |
@@ -78,6 +81,42 @@ class TestSonata(unittest.TestCase):
         various_albums2 = library.list_mark_various_artists_albums(albums2)
         self.assertEqual(various_albums2, albums2)
 
+    def test_list_identfy_VA_albums_runs(self):
+        def record(artist, album, path="p", year="2000"):
+            return song.SongRecord(artist=artist, album=album, path=path,
+                                   year=year)
+        VA = library.VARIOUS_ARTISTS
+
+        # Consecutive entries are the same album regardless of the case
+        albums = [record("a1", "Album"), record("a2", "ALBUM"),
+                  record("a1", "Other"), record("a1", "Other", path="q")]
+        self.assertEqual(library.list_mark_various_artists_albums(albums),
+                         [record(VA, "Album"), record("a1", "Other"),
+                          record("a1", "Other", path="q")])
+
+        # The same album in other directories goes into the VA album
+        albums = [record("a1", "A"), record("a2", "A"),
+                  record("a3", "a", path="q")]
+        self.assertEqual(library.list_mark_various_artists_albums(albums),
+                         [record(VA, "A")])
+
+        # Different years are different albums
+        albums = [record("a1", "A", year="1"), record("a2", "A", year="2")]
+        self.assertEqual(library.list_mark_various_artists_albums(albums),
+                         [record("a1", "A", year="1"),
+                          record("a2", "A", year="2")])
+
+        # Duplicate records of a single artist are kept once, and don't make
+        # a VA album...
+        albums = [record("a1", "A"), record("a1", "A"), record("a1", "A")]
+        self.assertEqual(library.list_mark_various_artists_albums(albums),
+                         [record("a1", "A")])
+
+        # ... but don't hide the other artists of the album either
+        albums = [record("a1", "A"), record("a1", "A"), record("a2", "A")]
+        self.assertEqual(library.list_mark_various_artists_albums(albums),
+                         [record(VA, "A")])
+
 
 class TestMPDSong(unittest.TestCase):
     def test_get_track_number(self):
@@ -90,6 +129,15 @@ class TestMPDSong(unittest.TestCase):
         self.assertEqual(1, MPDSong({'disc': '1/10'}).disc)
         self.assertEqual(1, MPDSong({'disc': '1,10'}).disc)
 
+    def test_cleanup_numeric(self):
+        self.assertEqual(3, cleanup_numeric('3/12'))
+        self.assertEqual(3, cleanup_numeric('03'))
+        self.assertEqual(3, cleanup_numeric(3))
+        self.assertEqual(0, cleanup_numeric(''))
+        self.assertEqual(0, cleanup_numeric('abc'))
+        self.assertEqual(0, cleanup_numeric('a/3'))
+        self.assertEqual(0, MPDSong({'track': ''}).track)
+
     def test_access_attributes(self):
         song = MPDSong({'foo': 'zz', 'id': '5'})
 
@@ -111,6 +159,388 @@ class TestMPDSong(unittest.TestCase):
         self.assertEqual('c', song.foo)
 
 
+class TestFormatting(unittest.TestCase):
+    def setUp(self):
+        self.item = {'artist': 'Artist', 'title': 'Title', 'date': '1999',
+                     'file': 'dir/file.mp3', 'track': '3', 'time': '125'}
+
+    def test_parse_codes(self):
+        self.assertEqual("Artist - Title",
+                         formatting.parse("%A - %T", self.item, False))
+        self.assertEqual("03. Title (02:05)",
+                         formatting.parse("%N. %T (%L)", self.item, False))
+        self.assertEqual("dir/file.mp3",
+                         formatting.parse("%P/%F", self.item, False))
+        self.assertEqual("A &amp; B",
+                         formatting.parse("%A", {'artist': 'A & B'}, True))
+
+    def test_parse_missing_tags(self):
+        item = {'file': 'dir/file.mp3'}
+        self.assertEqual("Unknown - file.mp3",
+                         formatting.parse("%A - %T", item, False))
+        self.assertEqual("? 00", formatting.parse("%Y %N", item, False))
+
+    def test_parse_brackets(self):
+        # Sections in brackets are only shown if all their tags are there
+        self.assertEqual("Artist (1999)",
+                         formatting.parse("%A{ - %B}{ (%Y)}", self.item,
+                                          False))
+        self.assertEqual("Title",
+                         formatting.parse("{%B - }%T", self.item, False))
+        self.assertEqual("Artist", formatting.parse("{%A}", self.item, False))
+        # The elapsed time is only known in the window title
+        self.assertEqual("Title", formatting.parse("%T{ %E}", self.item,
+                                                   False))
+
+    def test_parse_nested_brackets(self):
+        # Sections don't nest: the first } closes the section
+        self.assertEqual("a{Artistb}",
+                         formatting.parse("{a{%A}b}", self.item, False))
+        self.assertEqual("b}",
+                         formatting.parse("{a{%B}b}", self.item, False))
+
+
+class FakeMPDClient:
+    """Keeps track of the command list like python-mpd's client."""
+    def __init__(self, songs=None):
+        self.songs = songs or {}
+        self.searched = []
+        # 'command' fails the command list, 'connection' breaks the
+        # connection while sending it
+        self.failure = None
+        self.connected = True
+        self._command_list = None
+
+    def command_list_ok_begin(self):
+        if self._command_list is not None:
+            raise mpd.CommandListError("Already in command list")
+        self._command_list = []
+
+    def command_list_end(self):
+        if self._command_list is None:
+            raise mpd.CommandListError("Not in command list")
+        if self.failure == 'connection':
+            raise mpd.ConnectionError("Connection to server was reset")
+        results, self._command_list = self._command_list, None
+        if self.failure == 'command':
+            raise mpd.CommandError("[2@0] {search} incorrect arguments")
+        return results
+
+    def search(self, *args):
+        if self.failure == 'connection':
+            raise mpd.ConnectionError("Connection to server was reset")
+        self.searched.append(args)
+        result = self.songs.get(args, [])
+        if self._command_list is None:
+            return result
+        self._command_list.append(result)
+
+    def disconnect(self):
+        self.connected = False
+        self._command_list = None
+
+
+class TestMPDClient(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeMPDClient({('artist', 'a'): [{'file': 'f1'},
+                                                       {'file': 'f2'}],
+                                     ('artist', 'b'): [{'file': 'f3'}]})
+        self.mpd = MPDClient(client=self.client)
+
+    def test_command_list(self):
+        results = self.mpd.command_list('search', [('artist', 'a'),
+                                                   ('artist', 'c'),
+                                                   ('artist', 'b')])
+        self.assertEqual([['f1', 'f2'], [], ['f3']],
+                         [[song.file for song in songs] for songs in results])
+        self.assertIsInstance(results[0][0], MPDSong)
+        self.assertEqual([], self.mpd.command_list('search', []))
+
+    def test_command_list_failure(self):
+        self.client.failure = 'command'
+        with self.assertLogs('sonata.mpdhelper', 'ERROR'):
+            self.assertIsNone(self.mpd.command_list('search',
+                                                    [('artist', 'a')]))
+        self.assertTrue(self.client.connected)
+
+        # The next command list isn't sent inside the failed one
+        self.client.failure = None
+        self.assertEqual(1, len(self.mpd.command_list('search',
+                                                      [('artist', 'b')])[0]))
+
+    def test_command_list_connection_failure(self):
+        self.client.failure = 'connection'
+        with self.assertLogs('sonata.mpdhelper', 'ERROR'):
+            self.assertIsNone(self.mpd.command_list('search',
+                                                    [('artist', 'a')]))
+        # Left in an unknown state, the connection is dropped, which also
+        # resets the command list
+        self.assertFalse(self.client.connected)
+        self.assertIsNone(self.client._command_list)
+
+
+class TestLibrarySearch(unittest.TestCase):
+    def setUp(self):
+        notag = "Untagged"
+        songs = {
+            ('album', 'A', 'artist', notag): [
+                {'file': 'a/1', 'album': 'A', 'time': '100'},
+                # mpd's search matches substrings
+                {'file': 'ab/1', 'album': 'AB', 'time': '30'}],
+            ('album', 'A', 'artist', ''): [
+                {'file': 'a/2', 'album': 'a', 'artist': '', 'time': '50'}],
+        }
+        self.client = FakeMPDClient(songs)
+        self.library = library.Library.__new__(library.Library)
+        self.library.mpd = MPDClient(client=self.client)
+        self.library.NOTAG = notag
+        self.library.lib_query_memo = None
+        self.library.lib_query_failed = False
+
+    def search(self):
+        return self.library.library_return_search_items(
+            artist=self.library.NOTAG, album='A')
+
+    def test_search_items(self):
+        # The songs without an artist tag, or with an empty one, are found
+        # by separate searches
+        results, playtime, num_songs = self.search()
+        self.assertEqual(['a/1', 'a/2'], [song.file for song in results])
+        self.assertEqual(150, playtime)
+        self.assertEqual(2, num_songs)
+        self.assertEqual(2, len(self.client.searched))
+        self.assertFalse(self.library.lib_query_failed)
+
+    def test_search_items_memo(self):
+        self.library.lib_query_memo = {}
+        self.assertEqual(self.search(), self.search())
+        self.assertEqual(2, len(self.client.searched))
+
+    def test_search_items_failure(self):
+        self.client.failure = 'command'
+        with self.assertLogs('sonata.mpdhelper', 'ERROR'):
+            self.assertEqual(([], 0, 0), self.search())
+        # The view built from these results mustn't be cached
+        self.assertTrue(self.library.lib_query_failed)
+
+
+class FakeMainLoop:
+    """Runs the GLib sources added by the tested code when asked to."""
+    def __init__(self):
+        self.sources = {}
+        self.next_id = 1
+
+    def idle_add(self, func, *args):
+        source_id = self.next_id
+        self.next_id += 1
+        self.sources[source_id] = (func, args)
+        return source_id
+
+    def source_remove(self, source_id):
+        del self.sources[source_id]
+
+    def iterate(self):
+        for source_id, (func, args) in sorted(self.sources.items()):
+            if source_id in self.sources and not func(*args):
+                self.sources.pop(source_id, None)
+
+    def run(self):
+        while self.sources:
+            self.iterate()
+
+
+class FakeListStore:
+    def __init__(self):
+        self.rows = []
+
+    def get_n_columns(self):
+        return 3
+
+    def insert_with_valuesv(self, position, columns, row):
+        self.rows.append(row)
+
+
+class TestLibraryPopulate(unittest.TestCase):
+    def setUp(self):
+        self.loop = FakeMainLoop()
+        patcher = mock.patch.object(library, 'GLib', self.loop)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.populated = []
+        self.library = library.Library.__new__(library.Library)
+        self.library.library = mock.Mock()
+        self.library.artwork = mock.Mock()
+        self.library.library_populate_source = None
+        self.library.library_populated = \
+                lambda *args: self.populated.append(args)
+
+    def browse(self, size, *args):
+        # What library_browse does once it has the rows of the view
+        bd = [(i, (None, i, str(i))) for i in range(size)]
+        self.library.library_populate_cancel()
+        self.library.librarydata = FakeListStore()
+        self.library.library_populate_start(bd, args)
+        return self.library.librarydata, [row for _sort, row in bd]
+
+    def test_populate_in_batches(self):
+        model, rows = self.browse(1200, 'view')
+        # The first batch is shown right away
+        self.assertEqual(rows[:500], model.rows)
+        self.library.library.set_model.assert_called_once_with(model)
+        self.assertEqual([], self.populated)
+
+        self.loop.run()
+        self.assertEqual(rows, model.rows)
+        self.assertEqual([('view',)], self.populated)
+        self.assertIsNone(self.library.library_populate_source)
+
+    def test_populate_small_view(self):
+        model, rows = self.browse(10, 'view')
+        self.assertEqual(rows, model.rows)
+        self.assertEqual([('view',)], self.populated)
+        self.assertEqual({}, self.loop.sources)
+
+    def test_cancel_populate(self):
+        model, rows = self.browse(1200, 'view')
+        self.loop.iterate()
+        self.assertEqual(rows[:1000], model.rows)
+
+        self.library.library_populate_cancel()
+        self.assertEqual({}, self.loop.sources)
+        self.loop.run()
+        self.assertEqual(rows[:1000], model.rows)
+        self.assertEqual([], self.populated)
+
+    def test_browse_while_populating(self):
+        first_model, first_rows = self.browse(1200, 'first')
+        second_model, second_rows = self.browse(700, 'second')
+        self.loop.run()
+
+        # The pending rows don't go to the new view
+        self.assertEqual(first_rows[:500], first_model.rows)
+        self.assertEqual(second_rows, second_model.rows)
+        self.assertEqual([('second',)], self.populated)
+
+
+class FakeLabel:
+    def __init__(self, markup, use_markup=False):
+        self.markup = markup
+
+    def set_markup(self, markup):
+        self.markup = markup
+
+    def get_label(self):
+        return self.markup
+
+
+class FakeCrumbButton:
+    def __init__(self, image, label):
+        self.image = image
+        self.label = label
+        self.active = False
+        self.classes = set()
+        self.handlers = {}
+        self.next_handler = 1
+
+    def connect(self, signal, func, *args):
+        handler = self.next_handler
+        self.next_handler += 1
+        self.handlers[handler] = (func, args)
+        return handler
+
+    def disconnect(self, handler):
+        del self.handlers[handler]
+
+    def toggle(self):
+        for func, args in list(self.handlers.values()):
+            func(self, *args)
+
+    def handler_block(self, handler):
+        pass
+
+    handler_unblock = handler_block
+
+    def set_active(self, active):
+        self.active = active
+
+    def get_style_context(self):
+        return self
+
+    def add_class(self, name):
+        self.classes.add(name)
+
+    def remove_class(self, name):
+        self.classes.discard(name)
+
+    def set_tooltip_text(self, text):
+        pass
+
+    def show_all(self):
+        pass
+
+
+class TestLibraryBreadcrumbs(unittest.TestCase):
+    def setUp(self):
+        gtk = mock.MagicMock()
+        gtk.Label.side_effect = FakeLabel
+        gtk.Image.side_effect = mock.Mock
+        for patcher in (mock.patch.object(library, 'Gtk', gtk),
+                        mock.patch.object(library.breadcrumbs, 'CrumbButton',
+                                          FakeCrumbButton)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.library = library.Library.__new__(library.Library)
+        self.library.VIEWS = [(consts.VIEW_FILESYSTEM, 'filesystem', 'icon',
+                               "Filesystem")]
+        self.library.config = mock.Mock(lib_view=consts.VIEW_FILESYSTEM)
+        self.library.crumb_section = mock.MagicMock()
+        self.library.crumb_section_image = mock.Mock()
+        self.library.crumb_section_handler = None
+        self.library.crumb_buttons = []
+        self.library.breadcrumbs = mock.Mock()
+        self.library.library_browse = mock.Mock()
+
+    def browse(self, path):
+        self.library.config.wd = song.SongRecord(path=path)
+        self.library.update_breadcrumbs()
+        return [b for _crumb, b, _handler in self.library.crumb_buttons]
+
+    def test_reuse_buttons(self):
+        a, b, c = self.browse('a/b/c')
+        self.assertEqual(['a', 'b', 'c'], [x.label.markup for x in (a, b, c)])
+        self.assertEqual([False, False, True], [x.active for x in (a, b, c)])
+
+        # Going to a sibling of the parent: the button of the parent is
+        # reused for it, the other one is removed
+        buttons = self.browse('a/d')
+        self.assertEqual([a, b], buttons)
+        self.library.breadcrumbs.remove.assert_called_once_with(c)
+        self.assertEqual('d', b.label.markup)
+        self.assertEqual([False, True], [x.active for x in buttons])
+        self.assertEqual({'last_crumb'}, b.classes)
+        self.assertEqual(set(), a.classes)
+
+        # The reused button browses to its new location only
+        b.toggle()
+        self.library.library_browse.assert_called_once_with(
+            b, song.SongRecord(path='a/d'))
+
+    def test_shorter_path(self):
+        a, b, c = self.browse('a/b/c')
+        self.assertEqual([a], self.browse('a'))
+        self.assertEqual([mock.call(b), mock.call(c)],
+                         self.library.breadcrumbs.remove.call_args_list)
+        self.assertTrue(a.active)
+        self.assertEqual({'last_crumb'}, a.classes)
+
+        # Unchanged buttons keep their handler
+        a.toggle()
+        self.library.library_browse.assert_called_once_with(
+            a, song.SongRecord(path='a'))
+
+
 def additional_tests():
     return unittest.TestSuite(
         # TODO: add files which use doctests here